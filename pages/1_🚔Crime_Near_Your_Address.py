@@ -1,29 +1,31 @@
 import streamlit as st
 import pandas as pd
 import coloredlogs, logging
-from plotly import express as px
 from utils.st_helpers import (
     load_data, 
     get_options, 
-    get_df_group, 
+    get_group_summary, 
     plot_crimes_by_group, 
     sidebar_filters,
     sidebar_promo,
     page_footer,
-    get_mapbox_plot
+    get_page_icon,
+    paginated_dataframe,
+    get_mapbox_plot,
+    get_dataset_version,
+    load_neighbourhood_index
 )
-from utils.crime_finder import find_crimes_near_address
-from streamlit_theme import st_theme
-from PIL import Image
+from utils.figure_cache import cached_figure, figure_cache_key
+from utils.crime_finder import find_crimes_near_address, geocode_address
+from utils.geocoder import GeocoderUnavailable
 from decouple import config
 logger = logging.getLogger('crime_near_your_address')
 coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
 
 # --------------setup
-cn_tower_image = Image.open('./assets/FlaviConTC.png')
 st.set_page_config(
     page_title='TorCrime',
-    page_icon=cn_tower_image,
+    page_icon=get_page_icon(),
     layout="wide",
     initial_sidebar_state="auto", 
     menu_items=None
@@ -69,38 +71,60 @@ with st.form(key='my_form'):
     submit_button = st.form_submit_button(label='View Crimes 🦝', type='primary')
 
 if submit_button:
+    # keep the results on screen when the table's page controls trigger a rerun
+    st.session_state['address_submitted'] = True
+
+if st.session_state.get('address_submitted'):
+    try:
+        coords = geocode_address(address)
+    except GeocoderUnavailable as err:
+        logger.warning(err)
+        st.error("The address lookup service isn't responding right now 😕 - give it a minute and try again.")
+        page_footer()
+        st.stop()
+    if coords is None:
+        st.error(f"Couldn't find `{address}` 😕 - try adding the street type (St, Ave, ...) or the nearest intersection.")
+        page_footer()
+        st.stop()
+    located = load_neighbourhood_index().locate_one(lon=coords[1], lat=coords[0])
+    if located is not None:
+        # the only boundaries we ship are the 2016 (140) model, not the 158 the landing page filters on
+        st.info(f"📍 `{address}` is in **{located[1]}** (#{located[0]} in the 2016 140-neighbourhood model)")
     crimes_near_address_df = find_crimes_near_address(
         address=address, 
         crime_df=df_filtered,
         walking_mins=10
     )
     with st.spinner(f"📊 Plotting data..."):
-        df_group = get_df_group(crimes_near_address_df, group_by=group)
-        group_values = df_group.sort_values(by='Crimes', ascending=False)[group].unique().tolist()
+        group_summary = get_group_summary(crimes_near_address_df, group_by=group)
+        query_key = figure_cache_key('address', get_dataset_version(), years, crimes, premises, address)
         category_orders = plot_crimes_by_group(
-            metric_df=df_group, 
+            metric_df=group_summary['df_group'], 
             var_to_group_by_col=group, 
             bar_chart=True,
             metric_col='Crimes', 
-            hover_data=None
+            hover_data=None,
+            ranking=group_summary['ranking'],
+            cache_key=query_key
         )
 
         df_out = crimes_near_address_df[[
             'Date', 'Crime Type', 'Offence', 'Neighbourhood', 'Location Type', 'Premises Type', 'Year', 'Month', 'Day', 'Hour', 'Day of Week', 'Latitude', 'Longitude'
-        ]].sort_values(by=['Date', 'Hour'], ascending=[False, True])
-        df_out.index = range(1, df_out.shape[0]+1)
-
-        st.dataframe(df_out)
+        ]]
+        paginated_dataframe(df_out, columns=df_out.columns.tolist(), key='address_incidents')
 
     with st.spinner("Loading the map... 🗺️"):
         center = dict(lat=df_out['Latitude'].mean(), lon=df_out['Longitude'].mean())
-        p = get_mapbox_plot(
-            df=df_out, 
-            group=group, 
-            zoom=13, 
-            mapbox_style="carto-darkmatter", 
-            center=center,
-            category_orders=category_orders
+        p = cached_figure(
+            ('mapbox',) + query_key + (group, "carto-darkmatter"),
+            lambda: get_mapbox_plot(
+                df=df_out, 
+                group=group, 
+                zoom=13, 
+                mapbox_style="carto-darkmatter", 
+                center=center,
+                category_orders=category_orders
+            )
         )
         st.plotly_chart(p, use_container_width=True)
 
@@ -1,7 +1,6 @@
 import streamlit as st
 import pandas as pd
 import coloredlogs, logging
-from plotly import express as px
 from utils.st_helpers import (
     load_data, 
     get_options, 
@@ -9,21 +8,23 @@ from utils.st_helpers import (
     sidebar_filters,
     sidebar_promo,
     page_footer,
+    get_page_icon,
+    get_theme_base,
     get_hood_140_to_nbhd_mapping,
     load_counties,
-    load_neighbourhood_profiles
+    load_neighbourhood_profiles,
+    get_dataset_version
 )
-from PIL import Image
-from streamlit_theme import st_theme
+from utils.cache_policy import cache_data
+from utils.figure_cache import cached_figure, figure_cache_key
 from decouple import config
 logger = logging.getLogger('compare_neighbourhood_crime_rates')
 coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
 
 # --------------setup
-cn_tower_image = Image.open('./assets/FlaviConTC.png')
 st.set_page_config(
     page_title='TorCrime', 
-    page_icon=cn_tower_image, 
+    page_icon=get_page_icon(), 
     layout="wide", 
     initial_sidebar_state="auto", 
     menu_items=None
@@ -34,7 +35,7 @@ st.title("📊 Toronto Crime Dashboard")
 PRIMARY_METRICS = ['Total Major Crimes', 'Total Major Crimes / 1000 People', 'Total Major Crimes / km^2']
 
 # --------------helpers
-@st.cache_data()
+@cache_data()
 def filter_df(df, years, crimes, premises, neighbourhoods):
     df_filtered = df[
         (df['Year'] >= years[0]) &
@@ -46,7 +47,7 @@ def filter_df(df, years, crimes, premises, neighbourhoods):
         df_filtered = df_filtered[df_filtered['Neighbourhood'].isin(neighbourhoods)]
     return df_filtered
 
-@st.cache_data()
+@cache_data()
 def pivot_df(df_filtered):
     max_year = int(df_filtered['Year'].max())
     df_group = df_filtered.groupby(['ID', group, 'Year']).size().reset_index()
@@ -59,11 +60,16 @@ def pivot_df(df_filtered):
     df_pivot['Total Major Crimes / 1000 People'] = (df_pivot['Total Major Crimes'] / df_pivot['Population'] * 1000).round(1)
     df_pivot['Total Major Crimes / km^2'] = (df_pivot['Total Major Crimes'] / df_pivot['Land Area (km^2)']).round(1)
     df_pivot_max_year = df_pivot[df_pivot['Year'] == max_year]
-    return df_pivot, df_pivot_max_year, group_vals
-
-@st.cache_data()
-def prep_data_for_viz(df_in, primary_metric):
-    df_out = df_in.sort_values(by=[primary_metric], ascending=False)
+    # rank once for every primary metric so switching metrics is just a reindex
+    metric_orders = {
+        metric: df_pivot_max_year.sort_values(by=[metric], ascending=False).index.tolist()
+        for metric in PRIMARY_METRICS
+    }
+    return df_pivot, df_pivot_max_year, group_vals, metric_orders
+
+@cache_data()
+def prep_data_for_viz(df_in, primary_metric, metric_order):
+    df_out = df_in.loc[metric_order]
     df_out = df_out[
         ["Neighbourhood", primary_metric] + 
         [col for col in PRIMARY_METRICS if col != primary_metric] +
@@ -76,7 +82,6 @@ def prep_data_for_viz(df_in, primary_metric):
         df_out[col] = df_out[col].astype(float)
     return df_out
 
-@st.cache_data()
 def mapbox_plot(
     df_pivot_max_year, 
     counties, 
@@ -84,6 +89,7 @@ def mapbox_plot(
     group_vals,
     template
 ):
+    from plotly import express as px
     fig=(
         px.choropleth(df_pivot_max_year, 
             geojson=counties, 
@@ -99,9 +105,9 @@ def mapbox_plot(
             template=template,
         )
     )
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
 
-@st.cache_data()
+@cache_data()
 def st_dataframe(df_out, primary_metric):
     st.dataframe(
         df_out, 
@@ -175,26 +181,31 @@ df_filtered = filter_df(
     premises=premises, 
     neighbourhoods=neighbourhoods
 )
-df_pivot, df_pivot_max_year, group_vals = pivot_df(df_filtered=df_filtered)
-df_out = prep_data_for_viz(df_in=df_pivot_max_year, primary_metric=primary_metric)
+df_pivot, df_pivot_max_year, group_vals, metric_orders = pivot_df(df_filtered=df_filtered)
+df_out = prep_data_for_viz(
+    df_in=df_pivot_max_year,
+    primary_metric=primary_metric,
+    metric_order=metric_orders[primary_metric]
+)
 
 # -------------plotting
-theme = st_theme()
-if theme is not None:
-    if theme['base'] == 'dark':
-        template = "plotly_dark"
-    else:
-        template = "plotly"
+if get_theme_base() == 'dark':
+    template = "plotly_dark"
 else:
     template = "plotly"
 
-mapbox_plot(
-    df_pivot_max_year=df_pivot_max_year, 
-    counties=counties, 
-    primary_metric=primary_metric, 
-    group_vals=group_vals,
-    template=template
+query_key = figure_cache_key('compare', get_dataset_version(), years, crimes, premises, neighbourhoods, group)
+fig = cached_figure(
+    ('choropleth',) + query_key + (primary_metric, template),
+    lambda: mapbox_plot(
+        df_pivot_max_year=df_pivot_max_year, 
+        counties=counties, 
+        primary_metric=primary_metric, 
+        group_vals=group_vals,
+        template=template
+    )
 )
+st.plotly_chart(fig, use_container_width=True)
 
 st_dataframe(df_out=df_out, primary_metric=primary_metric)
 
@@ -203,6 +214,7 @@ plot_crimes_by_group(
     var_to_group_by_col="Neighbourhood",
     metric_col=primary_metric,
     bar_chart=True,
+    cache_key=query_key,
 )
 
 page_footer()
\ No newline at end of file
@@ -0,0 +1,228 @@
+"""
+One place for how much every st.cache_data helper may keep, and how well
+each cache is doing.
+
+    @cache_data()                # instead of @st.cache_data()
+    def filter_df(df, years, ...):
+
+Budgets (max_entries / ttl) are looked up by function name in
+CACHE_BUDGETS; anything not listed gets DEFAULT_BUDGET. On top of that,
+once all data caches together hold more than CACHE_MEMORY_MB, whole
+function caches are cleared, least useful first (fewest hits per MB;
+`pinned` ones - the dataset-wide loads every page needs - are never
+cleared, their budgets already keep them to a couple of entries).
+
+Per function hits, misses and evictions are logged every
+CACHE_STATS_LOG_SECONDS and returned by cache_stats() (see utils.load_test).
+Streamlit's /_stcore/metrics endpoint still reports the cache sizes.
+"""
+import functools
+import os
+import threading
+import time
+import streamlit as st
+import coloredlogs, logging
+from decouple import config
+logger = logging.getLogger(__name__)
+coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
+
+# --------------constants
+CACHE_MEMORY_MB = config('CACHE_MEMORY_MB', default=512, cast=float)
+CACHE_STATS_LOG_SECONDS = config('CACHE_STATS_LOG_SECONDS', default=300, cast=float)
+# scales every max_entries below, for bigger / smaller instances
+CACHE_MAX_ENTRIES_SCALE = config('CACHE_MAX_ENTRIES_SCALE', default=1.0, cast=float)
+HOUR = 60 * 60
+
+DEFAULT_BUDGET = {'max_entries': 32, 'ttl': HOUR, 'pinned': False}
+CACHE_BUDGETS = {
+    # dataset-wide: one entry per day / dataset version
+    'load_data': {'max_entries': 2, 'ttl': None, 'pinned': True},
+    'load_counties': {'max_entries': 1, 'ttl': None, 'pinned': True},
+    'load_neighbourhood_profiles': {'max_entries': 1, 'ttl': None, 'pinned': True},
+    'get_options': {'max_entries': 6, 'ttl': None},  # each page passes its own variant of the dataset
+    'get_hood_140_to_nbhd_mapping': {'max_entries': 2, 'ttl': None},
+    # per filter combination
+    'filter_df': {'max_entries': 32, 'ttl': HOUR},
+    'get_group_summary': {'max_entries': 128, 'ttl': HOUR},
+    'get_rollup_group_summary': {'max_entries': 256, 'ttl': 6 * HOUR},
+    'get_monthly_trend': {'max_entries': 256, 'ttl': 6 * HOUR},
+    'get_trailing_12_months': {'max_entries': 128, 'ttl': 6 * HOUR},
+    'pivot_df': {'max_entries': 64, 'ttl': HOUR},
+    'prep_data_for_viz': {'max_entries': 128, 'ttl': HOUR},
+    'st_dataframe': {'max_entries': 64, 'ttl': HOUR},
+    # per address
+    'geocode_address': {'max_entries': 2048, 'ttl': 24 * HOUR},
+    'find_crimes_near_address': {'max_entries': 32, 'ttl': HOUR},
+}
+
+_lock = threading.Lock()
+_stats = {}      # cache key -> counters
+_functions = {}  # cache key -> latest cached function (page scripts redefine theirs every rerun)
+_last_logged = time.monotonic()
+_usage_unavailable = False  # warned that streamlit's cache internals changed
+
+
+def get_budget(func_name):
+    budget = {**DEFAULT_BUDGET, **CACHE_BUDGETS.get(func_name, {})}
+    budget['max_entries'] = max(1, round(budget['max_entries'] * CACHE_MAX_ENTRIES_SCALE))
+    return budget
+
+
+def _display_name(func):
+    # page scripts all run as __main__, so name their helpers after the script instead
+    if func.__module__ == '__main__':
+        script = os.path.splitext(os.path.basename(func.__code__.co_filename))[0]
+        return f"{script}.{func.__qualname__}"
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+def _cache_key(cached_func, func):
+    """
+    streamlit's key for the function's cache (module, qualname and source), so
+    two pages' __main__.filter_df are counted, sized and cleared separately.
+    """
+    streamlit_cached_func = getattr(cached_func.clear, '__self__', None)  # .clear is bound to it
+    return getattr(streamlit_cached_func, '_function_key', None) or _display_name(func)
+
+
+def cache_data(**st_kwargs):
+    """st.cache_data with the function's budget from CACHE_BUDGETS, plus hit / miss / eviction accounting."""
+    def decorator(func):
+        budget = get_budget(func.__name__)
+
+        @functools.wraps(func)
+        def on_miss(*args, **kwargs):
+            result = func(*args, **kwargs)
+            with _lock:
+                stats['misses'] += 1
+            return result
+
+        cached_func = st.cache_data(
+            max_entries=budget['max_entries'], ttl=budget['ttl'], **st_kwargs
+        )(on_miss)
+        key = _cache_key(cached_func, func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _lock:
+                stats['calls'] += 1
+            misses = stats['misses']
+            result = cached_func(*args, **kwargs)
+            if stats['misses'] != misses:
+                _enforce_memory_budget()
+            _maybe_log_stats()
+            return result
+
+        wrapper.clear = cached_func.clear
+        with _lock:
+            # reruns of a page script redefine the function: same key, same counters
+            stats = _stats.setdefault(key, {
+                'name': _display_name(func), 'calls': 0, 'misses': 0, 'cleared': 0,
+                'max_entries': budget['max_entries'], 'ttl': budget['ttl'], 'pinned': budget['pinned'],
+            })
+            _functions[key] = wrapper
+        return wrapper
+    return decorator
+
+
+def _usage_by_cache():
+    """
+    {cache key: (live entries, bytes)}. streamlit's public stats are grouped by
+    display name, which the pages' __main__ helpers share, so this reads its
+    per-function caches. None if its internals change: sizes are then unknown
+    and the memory budget isn't enforced (warned about once).
+    """
+    global _usage_unavailable
+    try:
+        from streamlit.runtime.caching.cache_data_api import _data_caches
+        with _data_caches._caches_lock:
+            caches = list(_data_caches._function_caches.values())
+        usage = {}
+        for cache in caches:
+            entries = cache.get_stats()
+            usage[cache.key] = (len(entries), sum(entry.byte_length for entry in entries))
+        return usage
+    except Exception as err:
+        if not _usage_unavailable:
+            _usage_unavailable = True
+            logger.warning(
+                f"Can't read per-function cache sizes from streamlit ({err!r}), "
+                f"CACHE_MEMORY_MB isn't enforced ⚠️"
+            )
+        return None
+
+
+def _enforce_memory_budget():
+    usage = _usage_by_cache()
+    if usage is None:
+        return
+    total = sum(size for _, size in usage.values())
+    budget = CACHE_MEMORY_MB * 2**20
+    if total <= budget:
+        return
+    with _lock:
+        candidates = [
+            ((stats['calls'] - stats['misses']) / usage[key][1], key)
+            for key, stats in _stats.items() if not stats['pinned'] and usage.get(key, (0, 0))[1]
+        ]
+    for _, key in sorted(candidates):
+        if total <= budget:
+            break
+        entries, size = usage[key]
+        _functions[key].clear()
+        total -= size
+        with _lock:
+            _stats[key]['cleared'] += entries
+        logger.warning(
+            f"Data caches over {CACHE_MEMORY_MB:.0f}MB, cleared {_stats[key]['name']} ({size / 2**20:.1f}MB) 🧹"
+        )
+
+
+def cache_stats():
+    """
+    {function: counters} for every cache_data function:
+        calls / hits / misses / hit_rate
+        entries  - live entries (None if streamlit doesn't tell)
+        evicted  - entries dropped so far (max_entries, ttl and memory clears)
+        cleared  - of which dropped by memory-aware clears
+        mb       - size of the live entries (None if streamlit doesn't tell)
+    """
+    usage = _usage_by_cache()
+    with _lock:
+        snapshot = {key: dict(stats) for key, stats in _stats.items()}
+    report = {}
+    for key, stats in snapshot.items():
+        hits = stats['calls'] - stats['misses']
+        live, size = usage.get(key, (0, 0)) if usage is not None else (None, None)
+        name = stats.pop('name')
+        report[name] = {
+            **stats,
+            'hits': hits,
+            'hit_rate': round(hits / stats['calls'], 3) if stats['calls'] else None,
+            'entries': live,
+            'evicted': None if live is None else max(stats['misses'] - live, 0),
+            'mb': None if size is None else round(size / 2**20, 2),
+        }
+    return report
+
+
+def log_cache_stats():
+    lines = [
+        f"{name}: {stats['hits']}/{stats['calls']} hits, {stats['misses']} misses, "
+        f"{stats['entries']}/{stats['max_entries']} entries, {stats['evicted']} evicted "
+        f"({stats['cleared']} for memory), {stats['mb']}MB"
+        for name, stats in sorted(cache_stats().items())
+    ]
+    logger.info("cache stats 📊\n" + '\n'.join(lines))
+
+
+def _maybe_log_stats():
+    global _last_logged
+    if not CACHE_STATS_LOG_SECONDS:
+        return
+    now = time.monotonic()
+    with _lock:
+        if now - _last_logged < CACHE_STATS_LOG_SECONDS:
+            return
+        _last_logged = now
+    log_cache_stats()
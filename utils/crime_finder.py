@@ -1,15 +1,19 @@
 import streamlit as st
-from utils.geocoder import GeoCoder
-from geopy.distance import great_circle
 import coloredlogs, logging
 from tqdm import tqdm
-import time
+from utils.cache_policy import cache_data
 from decouple import config
 logger = logging.getLogger('geo_helpers')
 coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
-geocoder = GeoCoder()
+
+@st.cache_resource()
+def get_geocoder():
+    # built on first use (not import) so pages that never geocode don't pay for geopy / the API key lookup
+    from utils.geocoder import GeoCoder
+    return GeoCoder()
 
 def calc_distances(filtered_crime_df, lat, lon):
+    from geopy.distance import great_circle
     distances = []
     nrows = filtered_crime_df.shape[0]
     progress_bar = st.progress(0)
@@ -29,19 +33,29 @@ def calc_distances(filtered_crime_df, lat, lon):
     progress_bar.empty()
     return distances
 
-@st.cache_data()
+@cache_data()
+def geocode_address(address):
+    """
+    (lat, lon) of the address, or None if none of the geocoders could place it.
+    Raises utils.geocoder.GeocoderUnavailable if they failed / timed out instead,
+    which st.cache_data doesn't cache, so the next rerun tries again.
+    """
+    location = get_geocoder().geocode(address)
+    if isinstance(location, str): # => COULD_NOT_GEOCODE
+        return None
+    return location.latitude, location.longitude
+
+@cache_data()
 def find_crimes_near_address(address, crime_df, walking_mins=10):
     logger.info("Filtering to radius around address...")
     hours = walking_mins / 60
     km_radius = round(hours * 5, 3) # we assume 5 km/h walk speed
-    try:
-        location = geocoder.geocode(address)
-    except Exception as err:
-        logger.warn(f"{err}")
-        logger.warn(f"sleeping for 5 secs and trying again")
-        time.sleep(5)
-        location = geocoder.geocode(address)
-    lat, lon = location.latitude, location.longitude
+    coords = geocode_address(address)
+    if coords is None:
+        raise ValueError(f"Couldn't geocode '{address}'")
+    lat, lon = coords
+    # incidents the feed won't locate have no coordinates (see utils.data_schema.TORONTO_BOUNDS)
+    crime_df = crime_df[crime_df['lat'].notna() & crime_df['lon'].notna()]
     crime_df["distance_to_address"] = calc_distances(crime_df, lat, lon)
     crime_df_within_radius = (
         crime_df
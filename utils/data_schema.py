@@ -0,0 +1,192 @@
+"""
+Declarative schema for data/cleaned_crime_data.parquet and the vectorized
+checks utils.data_scraper runs on every page it pulls from ArcGIS.
+
+Each batch is cast column-by-column to CLEAN_SCHEMA. Rows are then either
+    - repaired: a bad optional value is nulled (unparseable numbers, out of
+      range hours/days/ids, unknown months/days of week, coordinates
+      outside Toronto), or
+    - rejected: a required value is missing or invalid (see REQUIRED_COLUMNS,
+      unknown mci_category, year out of range).
+Schema drift (missing columns, or a batch where more than
+MAX_REJECTED_FRACTION of rows get rejected) raises SchemaValidationError
+right away instead of surfacing later as NaNs in the dashboards.
+"""
+import json
+import pandas as pd
+import pyarrow as pa
+from decouple import config
+
+VALIDATION_METADATA_KEY = b'toronto_crime.validation'
+MAX_REJECTED_FRACTION = config('MAX_REJECTED_FRACTION', default=0.05, cast=float)
+
+# 'occurence_date' typo is intentional, see utils.data_scraper.COLUMN_MAP
+CLEAN_SCHEMA = pa.schema([
+    pa.field('mci_category', pa.string(), nullable=False),
+    pa.field('offence', pa.string()),
+    pa.field('occurrence_year', pa.int64(), nullable=False),
+    pa.field('occurrence_month', pa.string()),
+    pa.field('occurrence_day', pa.int64()),
+    pa.field('occurrence_hour', pa.int64()),
+    pa.field('occurrence_dow', pa.string()),
+    pa.field('location_type', pa.string()),
+    pa.field('premises_type', pa.string()),
+    pa.field('neighbourhood_158', pa.string(), nullable=False),
+    pa.field('hood_158', pa.int64()),
+    pa.field('neighbourhood_140', pa.string()),
+    pa.field('hood_140', pa.int64()),
+    pa.field('occurence_date', pa.date32(), nullable=False),
+    pa.field('latitude', pa.float64()),
+    pa.field('longitude', pa.float64()),
+])
+REQUIRED_COLUMNS = [field.name for field in CLEAN_SCHEMA if not field.nullable]
+
+KNOWN_VALUES = {
+    'mci_category': {'Assault', 'Auto Theft', 'Break and Enter', 'Robbery', 'Theft Over'},
+    'occurrence_month': {
+        'January', 'February', 'March', 'April', 'May', 'June', 'July',
+        'August', 'September', 'October', 'November', 'December'
+    },
+    'occurrence_dow': {
+        'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'
+    },
+}
+# inclusive; occurrence_year's upper bound is filled in with the current year
+VALUE_RANGES = {
+    'occurrence_year': (1900, None),
+    'occurrence_day': (1, 31),
+    'occurrence_hour': (0, 23),
+    'hood_158': (1, 174),
+    'hood_140': (1, 140),
+}
+# generous box around the city; the feed uses 0,0 for incidents it won't locate
+TORONTO_BOUNDS = {
+    'latitude': (43.55, 43.90),
+    'longitude': (-79.70, -79.05),
+}
+REJECT_ON = {'mci_category', 'occurrence_year'}  # invalid (not just missing) values that reject the row
+
+
+class SchemaValidationError(ValueError):
+    pass
+
+
+def require_columns(df, columns):
+    missing = [col for col in columns if col not in df.columns]
+    if missing:
+        raise SchemaValidationError(
+            f"ArcGIS schema drift, missing columns: {missing} (got {sorted(df.columns)})"
+        )
+
+
+def _cast_column(raw, arrow_type):
+    if pa.types.is_integer(arrow_type):
+        return pd.to_numeric(raw, errors='coerce').astype('Int64')
+    if pa.types.is_floating(arrow_type):
+        return pd.to_numeric(raw, errors='coerce').astype('float64')
+    if pa.types.is_date(arrow_type):
+        # the feed sends dates as epoch milliseconds
+        return pd.to_datetime(raw, unit='ms', errors='coerce').dt.date
+    return raw.where(raw.notna(), None).astype(object)
+
+
+def new_stats():
+    return {'rows_in': 0, 'rows_out': 0, 'rejected': {}, 'repaired': {}, 'verified': {}}
+
+
+def _count(counter, key, n):
+    if n:
+        counter[key] = counter.get(key, 0) + int(n)
+
+
+def merge_stats(total, batch):
+    total['rows_in'] += batch.get('rows_in', 0)
+    total['rows_out'] += batch.get('rows_out', 0)
+    for kind in ('rejected', 'repaired', 'verified'):
+        for key, n in batch.get(kind, {}).items():
+            _count(total[kind], key, n)
+    return total
+
+
+def validate_batch(raw_df, max_year=None):
+    """
+    Cast + check one batch of scraped rows (columns named as in CLEAN_SCHEMA).
+    Returns (clean DataFrame, stats); raises SchemaValidationError on drift.
+    """
+    require_columns(raw_df, CLEAN_SCHEMA.names)
+    if max_year is None:
+        max_year = pd.Timestamp.now().year
+    stats = new_stats()
+    stats['rows_in'] = len(raw_df)
+    df = pd.DataFrame(index=raw_df.index)
+    reject = pd.Series(False, index=raw_df.index)
+
+    for field in CLEAN_SCHEMA:
+        raw = raw_df[field.name]
+        col = _cast_column(raw, field.type)
+        unparseable = raw.notna() & col.isna()
+        if field.name in REQUIRED_COLUMNS:
+            _count(stats['rejected'], f'{field.name}:missing', (col.isna() & ~reject).sum())
+            reject |= col.isna()
+        else:
+            _count(stats['repaired'], f'{field.name}:unparseable', unparseable.sum())
+        df[field.name] = col
+
+    for name, (low, high) in VALUE_RANGES.items():
+        high = max_year if high is None else high
+        bad = df[name].notna() & ((df[name] < low) | (df[name] > high))
+        bad = bad.fillna(False).astype(bool)
+        if name in REJECT_ON:
+            _count(stats['rejected'], f'{name}:out_of_range', (bad & ~reject).sum())
+            reject |= bad
+        else:
+            _count(stats['repaired'], f'{name}:out_of_range', bad.sum())
+            df.loc[bad, name] = pd.NA
+
+    for name, known in KNOWN_VALUES.items():
+        bad = df[name].notna() & ~df[name].isin(known)
+        if name in REJECT_ON:
+            _count(stats['rejected'], f'{name}:unknown', (bad & ~reject).sum())
+            reject |= bad
+        else:
+            _count(stats['repaired'], f'{name}:unknown', bad.sum())
+            df.loc[bad, name] = None
+
+    outside = pd.Series(False, index=df.index)
+    for name, (low, high) in TORONTO_BOUNDS.items():
+        outside |= df[name].notna() & ~df[name].between(low, high)
+    _count(stats['repaired'], 'coordinates:outside_toronto', outside.sum())
+    df.loc[outside, list(TORONTO_BOUNDS)] = float('nan')
+
+    n_rejected = int(reject.sum())
+    if stats['rows_in'] and n_rejected / stats['rows_in'] > MAX_REJECTED_FRACTION:
+        raise SchemaValidationError(
+            f"{n_rejected}/{stats['rows_in']} rows rejected in one batch "
+            f"(> {MAX_REJECTED_FRACTION:.0%}), looks like schema drift: {stats['rejected']}"
+        )
+    df = df[~reject]
+    stats['rows_out'] = len(df)
+    return df, stats
+
+
+def to_arrow(df):
+    """Clean DataFrame -> Arrow table in CLEAN_SCHEMA."""
+    try:
+        return pa.Table.from_pandas(df, schema=CLEAN_SCHEMA, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as err:
+        raise SchemaValidationError(f"batch doesn't fit CLEAN_SCHEMA: {err}") from err
+
+
+def with_validation_stats(table, stats):
+    """Attach the validation stats to the table's (and so the parquet file's) metadata."""
+    metadata = dict(table.schema.metadata or {})
+    metadata[VALIDATION_METADATA_KEY] = json.dumps(stats).encode()
+    return table.replace_schema_metadata(metadata)
+
+
+def read_validation_stats(path):
+    import pyarrow.parquet as pq
+    metadata = pq.read_schema(path).metadata or {}
+    if VALIDATION_METADATA_KEY not in metadata:
+        return None
+    return json.loads(metadata[VALIDATION_METADATA_KEY])
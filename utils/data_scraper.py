@@ -1,8 +1,22 @@
+import os
 import time
 import requests
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import coloredlogs, logging
 from decouple import config
+from utils.data_schema import (
+    CLEAN_SCHEMA,
+    require_columns,
+    validate_batch,
+    new_stats,
+    merge_stats,
+    to_arrow,
+    with_validation_stats,
+)
+from utils.spatial import NeighbourhoodIndex, assign_neighbourhoods
+from utils import heatmaps
 
 logger = logging.getLogger(__name__)
 coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
@@ -53,29 +67,34 @@ def _get_with_retries(params, max_attempts=6):
             time.sleep(backoff)
 
 
-def _fetch_all_features():
+def _fetch_feature_pages():
+    """Yield the feed one page of features at a time, so each page can be validated as it lands."""
     logger.info("Hitting the API... 🎯")
     params = dict(BASE_PARAMS)
     result = _get_with_retries(params)
-    features = list(result.get('features', []))
-    logger.info(f"fetched {len(features)} so far... 🏃")
+    batch = result.get('features', [])
+    n_fetched = len(batch)
+    logger.info(f"fetched {n_fetched} so far... 🏃")
+    if batch:
+        yield batch
     while result.get('properties', {}).get('exceededTransferLimit'):
-        params['resultOffset'] = len(features)
+        params['resultOffset'] = n_fetched
         result = _get_with_retries(params)
         batch = result.get('features', [])
         if not batch:
             break
-        features.extend(batch)
-        logger.info(f"fetched {len(features)} so far... 🏃")
+        n_fetched += len(batch)
+        logger.info(f"fetched {n_fetched} so far... 🏃")
+        yield batch
         if len(batch) < PAGE_SIZE:
             break
-    logger.info(f"Done fetching. total features: {len(features)} ✅")
-    return features
+    logger.info(f"Done fetching. total features: {n_fetched} ✅")
 
 
 def _features_to_dataframe(features):
-    logger.info("Flattening features... 🧹")
+    """Flatten one page of GeoJSON features to raw CLEAN_SCHEMA columns; typing happens in validate_batch."""
     df = pd.json_normalize(features, sep='.')
+    require_columns(df, list(COLUMN_MAP) + ['properties.OCC_DATE', 'geometry.coordinates'])
     df = df.rename(columns=COLUMN_MAP)
 
     # geometry.coordinates is [longitude, latitude]
@@ -83,27 +102,33 @@ def _features_to_dataframe(features):
     df['longitude'] = coords.str[0]
     df['latitude'] = coords.str[1]
 
-    df['occurence_date'] = pd.to_datetime(
-        df['properties.OCC_DATE'], unit='ms', errors='coerce'
-    ).dt.date
-
-    for col in ('occurrence_year', 'occurrence_day', 'occurrence_hour',
-                'hood_140', 'hood_158'):
-        df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+    df['occurence_date'] = df['properties.OCC_DATE']
     df['occurrence_dow'] = df['occurrence_dow'].str.strip()
-
-    keep_cols = list(COLUMN_MAP.values()) + ['occurence_date', 'latitude', 'longitude']
-    df = df[keep_cols]
-    logger.info(f"Flattened. shape={df.shape} ✅")
-    return df
+    return df[CLEAN_SCHEMA.names]
 
 
 def scrape_data(write_path=DEFAULT_OUT_PATH):
-    features = _fetch_all_features()
-    df = _features_to_dataframe(features)
+    stats = new_stats()
+    tables = []
+    neighbourhood_index = NeighbourhoodIndex.from_file()
+    for features in _fetch_feature_pages():
+        df, batch_stats = validate_batch(_features_to_dataframe(features))
+        merge_stats(stats, batch_stats)
+        merge_stats(stats, assign_neighbourhoods(df, neighbourhood_index))
+        tables.append(to_arrow(df))
+    logger.info(f"Validation: {stats} 🔎")
+    if not tables:
+        tables = [to_arrow(pd.DataFrame(columns=CLEAN_SCHEMA.names))]
+    table = with_validation_stats(pa.concat_tables(tables), stats)
     logger.info(f"Writing parquet to {write_path}... 📁")
-    df.to_parquet(write_path, index=False)
-    logger.info(f"Wrote {df.shape[0]} rows to {write_path} ✅")
+    pq.write_table(table, write_path)
+    logger.info(f"Wrote {table.num_rows} rows to {write_path} ✅")
+    df = table.to_pandas()
+    heatmaps_path = os.path.join(os.path.dirname(write_path), heatmaps.HEATMAPS_FILE)
+    heatmaps.save_heatmaps(heatmaps.build_heatmaps(
+        df['mci_category'], df['occurrence_year'], df['latitude'], df['longitude']
+    ), heatmaps_path)
+    logger.info(f"Wrote crime heatmaps to {heatmaps_path} 🔥")
     return df
 
 
@@ -0,0 +1,70 @@
+"""
+The dashboards' view of the cleaned dataset - column names, crime type
+labels, neighbourhood names, population / land area for rates - without
+importing Streamlit, so utils.st_helpers and the query CLI (utils.query)
+can't drift apart.
+"""
+import pandas as pd
+
+NEIGHBOURHOOD_PROFILES_PATH = './data/neighbourhood-profiles-2016-140-model.csv'
+# raw (parquet) column -> dashboard column
+DASHBOARD_COLUMNS = {
+    'mci_category': 'Crime Type',
+    'offence': 'Offence',
+    'occurrence_year': 'Year',
+    'occurrence_month': 'Month',
+    'occurrence_day': 'Day',
+    'occurrence_hour': 'Hour',
+    'occurrence_dow': 'Day of Week',
+    'location_type': 'Location Type',
+    'premises_type': 'Premises Type',
+    'neighbourhood_158': 'Neighbourhood',
+    'occurence_date': 'Date',
+    'latitude': 'Latitude',
+    'longitude': 'Longitude',
+}
+RAW_COLUMNS = {dashboard: raw for raw, dashboard in DASHBOARD_COLUMNS.items()}
+CRIME_TYPE_LABELS = {'Theft Over': 'Theft Over $5k'}
+RAW_CRIME_TYPES = {label: raw for raw, label in CRIME_TYPE_LABELS.items()}
+INCIDENT_COLUMNS = [
+    'Date', 'Crime Type', 'Offence', 'Location Type', 'Premises Type', 'Year', 'Month', 'Day', 'Hour', 'Day of Week', 'Neighbourhood', 'Latitude', 'Longitude'
+]
+
+
+def clean_crime_types(crime_type):
+    return CRIME_TYPE_LABELS.get(crime_type, crime_type)
+
+
+def neighbourhood_name(label):
+    """'Annex (95)' -> 'Annex', the way the landing page shows neighbourhoods."""
+    return label.split('(')[0].strip()
+
+
+def to_dashboard_columns(df):
+    """Raw parquet columns (any subset) -> the columns / labels the dashboards use."""
+    df = df.rename(columns=DASHBOARD_COLUMNS)
+    if 'Crime Type' in df:
+        df['Crime Type'] = df['Crime Type'].apply(clean_crime_types)
+    if 'Neighbourhood' in df:
+        df['Neighbourhood'] = [
+            neighbourhood_name(nbhd) for nbhd in df['Neighbourhood']
+        ]
+    return df
+
+
+def read_neighbourhood_profiles(path=NEIGHBOURHOOD_PROFILES_PATH):
+    """ID / Neighbourhood / Population / Land Area (km^2) of the 140 neighbourhoods."""
+    neighbourhood_profiles = pd.read_csv(path)
+    nbhd_df = pd.DataFrame([])
+    nbhd_df['ID'] = pd.Series(neighbourhood_profiles[
+        neighbourhood_profiles['Characteristic'] == 'Neighbourhood Number'
+    ].iloc[0].values[6:]).pipe(pd.to_numeric, errors='coerce').astype('Int64')
+    nbhd_df['Neighbourhood'] = neighbourhood_profiles.columns[6:]
+    nbhd_df['Population'] = neighbourhood_profiles[
+        neighbourhood_profiles['Characteristic'] == 'Population, 2016'
+    ].iloc[0].values[6:]
+    nbhd_df['Population'] = nbhd_df['Population'].str.replace(',', '').astype(int)
+    nbhd_df['Land Area (km^2)'] = neighbourhood_profiles[
+        neighbourhood_profiles['Characteristic'] == 'Land area in square kilometres'
+    ].iloc[0].values[6:].astype(float)
+    return nbhd_df
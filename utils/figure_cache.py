@@ -0,0 +1,69 @@
+import threading
+from cachetools import LRUCache
+import coloredlogs, logging
+from decouple import config
+logger = logging.getLogger(__name__)
+coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
+
+# --------------constants
+FIGURE_CACHE_MB = config('FIGURE_CACHE_MB', default=128, cast=int)
+
+# Process-wide, so every session rendering the same query reuses the same
+# figure. Sized by the length of the serialized JSON, least recently used first out.
+_figure_cache = LRUCache(maxsize=FIGURE_CACHE_MB * 1024 * 1024, getsizeof=len)
+_lock = threading.Lock()
+_counters = {'hits': 0, 'misses': 0}
+
+
+def _freeze(part):
+    """Turn filter values (lists, arrays, dicts) into something hashable."""
+    if isinstance(part, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in part.items()))
+    if isinstance(part, (list, tuple, set, frozenset)) or hasattr(part, 'tolist'):
+        values = part.tolist() if hasattr(part, 'tolist') else part
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            return values  # numpy scalar
+        frozen = tuple(_freeze(v) for v in values)
+        return tuple(sorted(frozen, key=repr)) if isinstance(part, (set, frozenset)) else frozen
+    return part
+
+
+def figure_cache_key(*parts):
+    """
+    Build a figure cache key from whatever defines the figure, typically:
+    (query kind, dataset version, filters, group, metric, theme) plus the
+    figure name. The query kind (the page, e.g. 'address') keeps pages whose
+    filters look alike - an address vs a neighbourhood name - apart.
+    """
+    return _freeze(parts)
+
+
+def cached_figure(key, build_fig):
+    """Return the figure cached under key, building (and caching) it on a miss. key=None skips the cache."""
+    if key is None:
+        return build_fig()
+    with _lock:
+        fig_json = _figure_cache.get(key)
+        _counters['hits' if fig_json is not None else 'misses'] += 1
+    if fig_json is not None:
+        import plotly.io as pio
+        logger.debug(f"figure cache hit: {key[0]}")
+        return pio.from_json(fig_json)
+    fig = build_fig()
+    fig_json = fig.to_json()
+    try:
+        with _lock:
+            _figure_cache[key] = fig_json
+    except ValueError:
+        logger.warning(f"figure {key[0]} is larger than the whole figure cache ({FIGURE_CACHE_MB}MB), not caching it")
+    return fig
+
+
+def figure_cache_info():
+    with _lock:
+        return {
+            'figures': len(_figure_cache),
+            'bytes': _figure_cache.currsize,
+            'max_bytes': _figure_cache.maxsize,
+            **_counters,
+        }
@@ -1,7 +1,15 @@
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
-from geopy.geocoders import GoogleV3
+import asyncio
+import threading
+import time
+import coloredlogs, logging
 from decouple import config
+logger = logging.getLogger(__name__)
+coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
+
+COULD_NOT_GEOCODE = "Could Not Geocode Address"
+GEOCODER_TIMEOUT_SECONDS = config('GEOCODER_TIMEOUT_SECONDS', default=10, cast=float)
+# fire the Google fallback alongside Nominatim instead of after it (costs a Google call per lookup)
+GEOCODER_CONCURRENT_FALLBACK = config('GEOCODER_CONCURRENT_FALLBACK', default=False, cast=bool)
 
 STRINGS_TO_REPLACE = [
     ' st',
@@ -28,25 +36,145 @@ STRINGS_TO_REPLACE = [
     ' s'
 ]
 
+class GeocoderUnavailable(Exception):
+    """Every provider that could have placed the address failed or timed out - try again later."""
+
+
+def normalize_address(address):
+    return ' '.join(address.lower().split())
+
+
+class _AsyncRateLimiter():
+    """min_delay_seconds between calls, shared by everyone awaiting the same limiter."""
+
+    def __init__(self, min_delay_seconds) -> None:
+        self.min_delay_seconds = min_delay_seconds
+        self._lock = asyncio.Lock()
+        self._last_call = float('-inf')
+
+    async def wait(self):
+        async with self._lock:
+            delay = self._last_call + self.min_delay_seconds - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._last_call = time.monotonic()
+
+
 class GeoCoder():
+    """
+    Geocoding service shared by every session in the process. Lookups run on
+    one background event loop, so each provider has a single rate-limit
+    budget, and concurrent lookups of the same (normalized) address share
+    one request.
 
-    def __init__(self) -> None:
-        self.nomatim_geolocator = Nominatim(user_agent="toronto_crime_app")
-        self.google_geolocator = GoogleV3(api_key=config("GOOGLE_API_KEY"))
-        self.nomatim_geocoder = RateLimiter(self.nomatim_geolocator.geocode, min_delay_seconds=1)
-        self.google_geocoder = RateLimiter(self.google_geolocator.geocode, min_delay_seconds=1)
+    providers - {'nominatim': fn, 'google': fn} of blocking address -> location
+        callables; defaults to the geopy clients (google only if GOOGLE_API_KEY is set).
+        Pass stubs here to exercise the service without hitting the network.
+    """
+
+    def __init__(
+            self,
+            providers=None,
+            min_delay_seconds=1,
+            timeout=GEOCODER_TIMEOUT_SECONDS,
+            concurrent_fallback=GEOCODER_CONCURRENT_FALLBACK
+        ) -> None:
+        if providers is None:
+            providers = self._default_providers(timeout)
+        self.providers = providers
+        self.timeout = timeout
+        self.concurrent_fallback = concurrent_fallback
+        self._rate_limiters = {
+            name: _AsyncRateLimiter(min_delay_seconds) for name in providers
+        }
+        self._in_flight = {}
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=self._loop.run_forever, name='geocoder-loop', daemon=True
+        ).start()
+
+    @staticmethod
+    def _default_providers(timeout):
+        # imported here so importing GeocoderUnavailable doesn't pull in geopy
+        from geopy.geocoders import Nominatim
+        from geopy.geocoders import GoogleV3
+        providers = {
+            'nominatim': Nominatim(user_agent="toronto_crime_app", timeout=timeout).geocode,
+        }
+        google_api_key = config("GOOGLE_API_KEY", default=None)
+        if google_api_key:
+            providers['google'] = GoogleV3(api_key=google_api_key, timeout=timeout).geocode
+        else:
+            logger.warning("GOOGLE_API_KEY not set, geocoding with Nominatim only")
+        return providers
 
     def geocode(self, address):
-        location = self.nomatim_geocoder(address)
+        """
+        Blocking entry point for the (sync) streamlit script thread: the location,
+        COULD_NOT_GEOCODE if no provider knows the address, or GeocoderUnavailable
+        if none found it and some of them failed, so the answer isn't known yet.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._coalesced(address), self._loop
+        ).result()
+
+    async def geocode_async(self, address):
+        """Same as geocode, awaitable from any event loop."""
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(self._coalesced(address), self._loop)
+        )
+
+    async def _coalesced(self, address):
+        # only ever runs on self._loop, so _in_flight is never touched from another thread
+        key = normalize_address(address)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._loop.create_task(self._geocode(address))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            logger.info(f"joining in-flight geocode for '{key}'")
+        # shield so one caller giving up doesn't cancel the lookup for the others
+        return await asyncio.shield(task)
+
+    async def _geocode(self, address):
+        clean_address = self._clean_address(address)
+        # we add this check bc the google maps api seems to find an address for anything
+        google_allowed = (
+            'google' in self.providers and
+            sum([s in address.lower() for s in STRINGS_TO_REPLACE]) > 0
+        )
+        errors = []
+        google_task = None
+        if google_allowed and self.concurrent_fallback:
+            google_task = self._loop.create_task(self._call('google', clean_address, errors))
+
+        location = await self._call('nominatim', address, errors)
         if location is None:
-            clean_address = self._clean_address(address)
-            location = self.nomatim_geocoder(clean_address)
-            if location is None and sum([s in address.lower() for s in STRINGS_TO_REPLACE]) > 0: # we add this 2nd check bc the google maps api seems to find an address for anything
-                location = self.google_geocoder(clean_address)
+            location = await self._call('nominatim', clean_address, errors)
+            if location is None and google_allowed:
+                location = await (google_task or self._call('google', clean_address, errors))
+        if google_task is not None and not google_task.done():
+            google_task.cancel()
+        if location is None and errors: # => a provider that might have found it didn't answer
+            raise GeocoderUnavailable(f"Couldn't geocode '{address}' right now: {errors[-1]!r}")
         if location is None: # => wasn't fixed by any attempts above
-            location = "Could Not Geocode Address"
+            location = COULD_NOT_GEOCODE
         return location
 
+    async def _call(self, provider, address, errors):
+        await self._rate_limiters[provider].wait()
+        try:
+            return await asyncio.wait_for(
+                asyncio.to_thread(self.providers[provider], address),
+                timeout=self.timeout
+            )
+        except Exception as err:
+            # a failed or slow provider counts as a miss so the fallbacks still get a go,
+            # but it's noted in errors so the lookup isn't reported (and cached) as not found
+            logger.warning(f"{provider} geocode failed for '{address}': {err!r}")
+            errors.append(err)
+            return None
 
     def _clean_address(self, address):
         if '+' in address or ' and ' in address.lower() or '&' in address:
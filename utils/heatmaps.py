@@ -0,0 +1,120 @@
+"""
+City-wide crime density rasters, so the landing page can show a heatmap for
+"All Neighbourhoods" without shipping every incident to the browser.
+
+Incidents are binned once per publish (utils.data_scraper / the snapshot
+writer) into a grid of HEATMAP_CELL_METRES cells over
+utils.data_schema.TORONTO_BOUNDS, one raster per raw mci_category x year:
+a single np.bincount over all incidents. Only the integer counts are stored
+(HEATMAPS_FILE, compressed npz - mostly empty cells, so it stays small).
+
+Smoothing is linear, so the rasters for the selected crime types / years are
+summed first and the sum is smoothed once with a separable Gaussian
+(HEATMAP_BANDWIDTH_METRES) - the same result as smoothing every raster ahead
+of time, for a fraction of the storage.
+"""
+import os
+import numpy as np
+import pandas as pd
+from decouple import config
+from utils.data_schema import TORONTO_BOUNDS
+
+HEATMAPS_FILE = 'crime_heatmaps.npz'
+HEATMAP_CELL_METRES = config('HEATMAP_CELL_METRES', default=200, cast=float)
+HEATMAP_BANDWIDTH_METRES = config('HEATMAP_BANDWIDTH_METRES', default=400, cast=float)
+METRES_PER_DEGREE_LAT = 111_320
+
+
+def grid(cell_metres=HEATMAP_CELL_METRES):
+    """Cell edges (lat_edges, lon_edges) covering TORONTO_BOUNDS."""
+    (lat_min, lat_max), (lon_min, lon_max) = TORONTO_BOUNDS['latitude'], TORONTO_BOUNDS['longitude']
+    lat_step = cell_metres / METRES_PER_DEGREE_LAT
+    lon_step = lat_step / np.cos(np.radians((lat_min + lat_max) / 2))
+    n_lat = int(np.ceil((lat_max - lat_min) / lat_step))
+    n_lon = int(np.ceil((lon_max - lon_min) / lon_step))
+    return lat_min + lat_step * np.arange(n_lat + 1), lon_min + lon_step * np.arange(n_lon + 1)
+
+
+def build_heatmaps(crime_type, year, lat, lon, cell_metres=HEATMAP_CELL_METRES):
+    """
+    Incident columns -> {'counts': (crime types, years, lat cells, lon cells),
+    'crime_types', 'years', 'lat_edges', 'lon_edges', 'cell_metres'}.
+    Incidents without coordinates (or outside the grid) are left out.
+    """
+    lat_edges, lon_edges = grid(cell_metres)
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    type_codes, crime_types = pd.factorize(pd.Series(crime_type), sort=True)
+    year_codes, years = pd.factorize(pd.Series(year), sort=True)
+    lat_idx = np.floor((lat - lat_edges[0]) / (lat_edges[1] - lat_edges[0]))
+    lon_idx = np.floor((lon - lon_edges[0]) / (lon_edges[1] - lon_edges[0]))
+    n_lat, n_lon = len(lat_edges) - 1, len(lon_edges) - 1
+    keep = (
+        (type_codes >= 0) & (year_codes >= 0) &
+        (lat_idx >= 0) & (lat_idx < n_lat) & (lon_idx >= 0) & (lon_idx < n_lon)
+    )  # NaN coordinates fail every comparison
+    shape = (len(crime_types), len(years), n_lat, n_lon)
+    flat = np.ravel_multi_index((
+        type_codes[keep], year_codes[keep],
+        lat_idx[keep].astype(np.int64), lon_idx[keep].astype(np.int64)
+    ), shape)
+    counts = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+    dtype = np.uint16 if counts.max(initial=0) <= np.iinfo(np.uint16).max else np.uint32
+    return {
+        'counts': counts.astype(dtype),
+        'crime_types': np.asarray(crime_types, dtype=str),
+        'years': np.asarray(years, dtype=np.int64),
+        'lat_edges': lat_edges,
+        'lon_edges': lon_edges,
+        'cell_metres': np.float64(cell_metres),
+    }
+
+
+def from_parquet(path):
+    """Heatmaps straight from a cleaned parquet (raw column names), reading only the 4 columns needed."""
+    df = pd.read_parquet(path, columns=['mci_category', 'occurrence_year', 'latitude', 'longitude'])
+    return build_heatmaps(df['mci_category'], df['occurrence_year'], df['latitude'], df['longitude'])
+
+
+def save_heatmaps(heatmaps, path):
+    tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez_compressed(tmp_path, **heatmaps)
+    os.replace(tmp_path, path)
+
+
+def load_heatmaps(path):
+    with np.load(path) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+def _gaussian_matrix(n, sigma_cells):
+    """(n, n) matrix that smooths a length-n axis with a truncated, edge-normalized Gaussian."""
+    offsets = np.arange(n)[:, None] - np.arange(n)[None, :]
+    weights = np.exp(-0.5 * (offsets / sigma_cells) ** 2)
+    weights[np.abs(offsets) > 4 * sigma_cells] = 0
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def density(heatmaps, crime_types=None, years=None, bandwidth_metres=HEATMAP_BANDWIDTH_METRES):
+    """
+    Smoothed crimes per km^2 (lat cells x lon cells) for the selected raw crime
+    types / (min, max) years; None means all of them.
+    """
+    type_mask = np.ones(len(heatmaps['crime_types']), dtype=bool)
+    if crime_types is not None:
+        type_mask = np.isin(heatmaps['crime_types'], list(crime_types))
+    year_mask = np.ones(len(heatmaps['years']), dtype=bool)
+    if years is not None:
+        year_mask = (heatmaps['years'] >= years[0]) & (heatmaps['years'] <= years[1])
+    raster = heatmaps['counts'][type_mask][:, year_mask].sum(axis=(0, 1), dtype=np.float64)
+    cell_metres = float(heatmaps['cell_metres'])
+    sigma_cells = bandwidth_metres / cell_metres
+    if sigma_cells > 0:
+        # separable Gaussian: smooth along latitude, then longitude
+        raster = _gaussian_matrix(raster.shape[0], sigma_cells) @ raster @ _gaussian_matrix(raster.shape[1], sigma_cells).T
+    return raster / (cell_metres / 1000) ** 2
+
+
+def cell_centres(heatmaps):
+    lat_edges, lon_edges = heatmaps['lat_edges'], heatmaps['lon_edges']
+    return (lat_edges[:-1] + lat_edges[1:]) / 2, (lon_edges[:-1] + lon_edges[1:]) / 2
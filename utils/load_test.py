@@ -0,0 +1,290 @@
+"""
+Headless load test: simulated sessions replaying a mix of interactions on
+all three pages through streamlit's AppTest. Sessions run in threads of
+this one process, so they share the caches (and the GIL) the way sessions
+on one server instance do.
+
+    python -m utils.load_test --sessions 8 --reruns 25 [--think 2] [--seed 0] [--cold] [--json report.json]
+
+AppTest swaps in a process-global mock runtime for every run, so reruns
+are executed one at a time; sessions "think" for ~--think seconds between
+interactions. Latency is what the user waits (queueing behind other
+sessions' reruns + the rerun itself), `run` is the rerun alone - when
+latency pulls away from run, reruns are queueing up.
+
+Each session visits a random page and clicks around it for a few reruns:
+    neighbourhood page - neighbourhood, group by, year slider
+    address page       - addresses (geocoder stubbed, no network), group by
+    compare page       - group by, primary metric, year slider
+Reports rerun latency percentiles (overall, per page and per interaction),
+RSS growth, and figure / data cache hit rates (data: per function).
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import coloredlogs, logging
+from decouple import config
+logger = logging.getLogger(__name__)
+coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
+
+PAGES = {
+    'neighbourhood': '🦝Crime_in_Your_Neighbourhood.py',
+    'address': 'pages/1_🚔Crime_Near_Your_Address.py',
+    'compare': 'pages/2_📊Compare_Neighbourhood_Crime_Rates.py',
+}
+PAGE_WEIGHTS = {'neighbourhood': 0.5, 'address': 0.3, 'compare': 0.2}
+RERUNS_PER_VISIT = (2, 6)
+ADDRESSES = [
+    '100 Queen St W', '1 Dundas St W', '2300 Yonge St', '55 Bloor St W',
+    '1000 Gerrard St E', '3401 Dufferin St', '900 Dufferin St', '10 Dundas St E',
+    '300 Borough Dr', '1 Blue Jays Way', '5100 Yonge St', '222 Bremner Blvd',
+]
+PERCENTILES = [50, 90, 99]
+RUN_TIMEOUT_SECONDS = 600
+
+_run_lock = threading.Lock()
+
+_Location = namedtuple('_Location', 'latitude longitude')
+
+
+def _stub_geocoder():
+    """GeoCoder whose only provider places each address at a fixed, made up point downtown-ish."""
+    from utils.geocoder import GeoCoder
+
+    def locate(address):
+        rng = random.Random(address)
+        return _Location(43.65 + rng.uniform(-0.04, 0.08), -79.40 + rng.uniform(-0.12, 0.12))
+
+    return GeoCoder(providers={'nominatim': locate}, min_delay_seconds=0)
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:  # no procfs (macos): peak instead of current
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**20
+
+
+def _widget(widgets, label):
+    return next(w for w in widgets if w.label == label)
+
+
+def _pick_option(label):
+    def interact(at, rng):
+        widget = _widget(at.selectbox, label)
+        widget.select(rng.choice(widget.options))
+    return interact
+
+
+def _pick_years(at, rng):
+    slider = _widget(at.slider, 'Year')
+    low, high = sorted(rng.sample(range(int(slider.min), int(slider.max) + 1), 2))
+    slider.set_range(low, high)
+
+
+def _enter_address(at, rng):
+    _widget(at.text_input, 'Enter an address').set_value(rng.choice(ADDRESSES))
+    at.button[0].click()
+
+
+INTERACTIONS = {
+    'neighbourhood': {
+        'neighbourhood': _pick_option('Choose a Neighbourhood'),
+        'group_by': _pick_option('Group By'),
+        'years': _pick_years,
+    },
+    'address': {
+        'address': _enter_address,
+        'group_by': _pick_option('Group By'),
+    },
+    'compare': {
+        'group_by': _pick_option('Group By'),
+        'metric': _pick_option('Primary Metric'),
+        'years': _pick_years,
+    },
+}
+
+
+def _run_session(session_id, reruns, seed, think_seconds):
+    from streamlit.testing.v1 import AppTest
+    rng = random.Random(seed + session_id)
+    samples = []
+
+    def timed_run(at, page, interaction):
+        if think_seconds:
+            time.sleep(rng.expovariate(1 / think_seconds))
+        requested = time.perf_counter()
+        with _run_lock:
+            start = time.perf_counter()
+            at.run()
+        end = time.perf_counter()
+        samples.append({
+            'session': session_id,
+            'page': page,
+            'interaction': interaction,
+            'seconds': end - requested,
+            'run_seconds': end - start,
+            'error': bool(at.exception),
+        })
+
+    while len(samples) < reruns:
+        page = rng.choices(list(PAGE_WEIGHTS), weights=PAGE_WEIGHTS.values())[0]
+        at = AppTest.from_file(PAGES[page], default_timeout=RUN_TIMEOUT_SECONDS)
+        timed_run(at, page, 'load')
+        if page == 'address':  # start from a search, like most visits do
+            _enter_address(at, rng)
+            timed_run(at, page, 'address')
+        for _ in range(rng.randint(*RERUNS_PER_VISIT)):
+            if len(samples) >= reruns or at.exception:
+                break
+            interaction, interact = rng.choice(list(INTERACTIONS[page].items()))
+            interact(at, rng)
+            timed_run(at, page, interaction)
+    return samples
+
+
+def _latency_summary(samples):
+    ms = np.array([sample['seconds'] for sample in samples]) * 1000
+    run_ms = np.array([sample['run_seconds'] for sample in samples]) * 1000
+    return {
+        'reruns': int(ms.size),
+        **{f'p{p}_ms': round(float(np.percentile(ms, p)), 1) for p in PERCENTILES},
+        'max_ms': round(float(ms.max()), 1),
+        **{f'run_p{p}_ms': round(float(np.percentile(run_ms, p)), 1) for p in PERCENTILES},
+    }
+
+
+def _data_cache_report(start, end):
+    """Hits / misses during the run (from utils.cache_policy counters) and what's held at the end."""
+    report = {}
+    for name, stats in sorted(end.items()):
+        before = start.get(name, {'calls': 0, 'misses': 0})
+        calls = stats['calls'] - before['calls']
+        misses = stats['misses'] - before['misses']
+        if not calls:
+            continue
+        report[name] = {
+            'calls': calls,
+            'hit_rate': round(1 - misses / calls, 3),
+            'entries': stats['entries'],
+            'evicted': stats['evicted'],
+            'mb': stats['mb'],
+        }
+    return report
+
+
+def run_load_test(sessions=8, reruns=25, think_seconds=2.0, seed=0, warm=True):
+    """Simulate `sessions` concurrent sessions of `reruns` reruns each. Returns the report dict."""
+    import utils.crime_finder as crime_finder
+    from utils.cache_policy import cache_stats
+    from utils.figure_cache import figure_cache_info
+    geocoder = _stub_geocoder()
+    crime_finder.get_geocoder = lambda: geocoder
+
+    if warm:
+        from streamlit.testing.v1 import AppTest
+        from utils.warmup import _warm_up_script
+        AppTest.from_function(_warm_up_script, default_timeout=RUN_TIMEOUT_SECONDS).run()
+
+    rss_start = _rss_mb()
+    figures_start = figure_cache_info()
+    data_cache_start = cache_stats()
+    peak = {'rss_mb': rss_start}
+    done = threading.Event()
+
+    def sample_rss():
+        while not done.wait(0.5):
+            peak['rss_mb'] = max(peak['rss_mb'], _rss_mb())
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(lambda i: _run_session(i, reruns, seed, think_seconds), range(sessions)))
+    wall_seconds = time.perf_counter() - start
+    done.set()
+    sampler.join()
+
+    samples = [sample for session in results for sample in session]
+    figures_end = figure_cache_info()
+    hits = figures_end['hits'] - figures_start['hits']
+    misses = figures_end['misses'] - figures_start['misses']
+    by_page, by_interaction = {}, {}
+    for sample in samples:
+        by_page.setdefault(sample['page'], []).append(sample)
+        by_interaction.setdefault(f"{sample['page']}:{sample['interaction']}", []).append(sample)
+    return {
+        'sessions': sessions,
+        'wall_seconds': round(wall_seconds, 2),
+        'reruns_per_second': round(len(samples) / wall_seconds, 2),
+        'errors': sum(sample['error'] for sample in samples),
+        'think_seconds': think_seconds,
+        'latency': _latency_summary(samples),
+        'latency_by_page': {k: _latency_summary(v) for k, v in sorted(by_page.items())},
+        'latency_by_interaction': {k: _latency_summary(v) for k, v in sorted(by_interaction.items())},
+        'memory': {
+            'rss_start_mb': round(rss_start, 1),
+            'rss_end_mb': round(_rss_mb(), 1),
+            'rss_peak_mb': round(peak['rss_mb'], 1),
+        },
+        'figure_cache': {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+            'figures': figures_end['figures'],
+            'mb': round(figures_end['bytes'] / 2**20, 2),
+        },
+        'data_cache': _data_cache_report(data_cache_start, cache_stats()),
+    }
+
+
+def _log_report(report):
+    logger.info(
+        f"{report['sessions']} sessions, {report['latency']['reruns']} reruns in {report['wall_seconds']}s "
+        f"({report['reruns_per_second']}/s), {report['errors']} errors"
+    )
+    header = (
+        f"{'':32}{'reruns':>8}" + ''.join(f"{f'p{p}':>9}" for p in PERCENTILES) + f"{'max':>9}"
+        + ''.join(f"{f'run p{p}':>11}" for p in PERCENTILES)
+    )
+    rows = [header]
+    for name, summary in [('all', report['latency']), *report['latency_by_page'].items(),
+                          *report['latency_by_interaction'].items()]:
+        rows.append(
+            f"{name:32}{summary['reruns']:>8}"
+            + ''.join(f"{summary[f'p{p}_ms']:>9}" for p in PERCENTILES)
+            + f"{summary['max_ms']:>9}"
+            + ''.join(f"{summary[f'run_p{p}_ms']:>11}" for p in PERCENTILES)
+        )
+    logger.info("rerun latency (ms):\n" + '\n'.join(rows))
+    logger.info(f"memory (MB): {report['memory']}")
+    logger.info(f"figure cache: {report['figure_cache']}")
+    logger.info("data cache:\n" + '\n'.join(
+        f"{name:58}{stats['calls']:>6} calls {stats['hit_rate']:>7.1%} hits "
+        f"{stats['entries']} entries {stats['evicted']} evicted {stats['mb']}MB"
+        for name, stats in report['data_cache'].items()
+    ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=8, help='concurrent sessions')
+    parser.add_argument('--reruns', type=int, default=25, help='reruns per session')
+    parser.add_argument('--think', type=float, default=2.0, help='mean seconds between interactions')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cold', action='store_true', help="don't warm the caches first")
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+    report = run_load_test(args.sessions, args.reruns, args.think, seed=args.seed, warm=not args.cold)
+    _log_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,285 @@
+"""
+Query the cleaned dataset from the command line, with the dashboards'
+filters and numbers but without Streamlit:
+
+    # incidents (the landing page's table); --columns picks dashboard columns
+    python -m utils.query incidents --years 2022 2023 --crime Assault --neighbourhood Annex -o annex.csv
+    # crimes per group value and year (the landing page's charts)
+    python -m utils.query group --by "Premises Type" --crime Robbery -o robbery.parquet
+    # crimes, crimes / 1000 people and crimes / km^2 per neighbourhood and year (the compare page)
+    python -m utils.query rates --by "Crime Type" --years 2023 2023 -o rates.json
+
+Filters take dashboard values (--crime "Theft Over $5k", --neighbourhood
+Annex or "Annex (95)") and are pushed down to the parquet scan, which
+only reads the columns it needs. Results are written batch by batch as
+they're scanned (group / rates keep only their running counts), so large
+extracts run in bounded memory. Output format follows the -o extension
+(.csv / .parquet / .json = JSON lines), or --format; -o - (default) is stdout.
+Reads the current snapshot (utils.snapshots), or --data.
+"""
+import argparse
+import functools
+import operator
+import os
+import sys
+from contextlib import contextmanager
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import coloredlogs, logging
+from decouple import config
+from utils import snapshots
+from utils.dataset import (
+    INCIDENT_COLUMNS,
+    RAW_COLUMNS,
+    RAW_CRIME_TYPES,
+    neighbourhood_name,
+    read_neighbourhood_profiles,
+    to_dashboard_columns,
+)
+logger = logging.getLogger(__name__)
+coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
+
+LOCAL_DATA_PATH = 'data/cleaned_crime_data.parquet'
+BATCH_ROWS = config('QUERY_BATCH_ROWS', default=65_536, cast=int)
+FORMATS = ['csv', 'parquet', 'json']
+GROUP_COLUMNS = [
+    'Crime Type', 'Offence', 'Location Type', 'Premises Type', 'Month', 'Day of Week', 'Hour', 'Neighbourhood'
+]
+RATE_METRICS = ['Total Major Crimes', 'Total Major Crimes / 1000 People', 'Total Major Crimes / km^2']
+RATE_GROUP_COLUMNS = ['Crime Type', 'Premises Type']
+
+
+def default_data_path():
+    version = snapshots.current_version()
+    if version is not None:
+        path = snapshots.snapshot_path(version, snapshots.DATA_FILE)
+        if os.path.exists(path):
+            return path
+    return LOCAL_DATA_PATH
+
+
+def _distinct(dataset, column):
+    values = set()
+    for batch in dataset.to_batches(columns=[column], batch_size=BATCH_ROWS):
+        values.update(batch.column(column).unique().to_pylist())
+    values.discard(None)
+    return values
+
+
+def _neighbourhood_labels(dataset, column, neighbourhoods):
+    """Raw labels ('Annex (95)') matching neighbourhoods given either as labels or as names ('Annex')."""
+    wanted = set(neighbourhoods)
+    labels = [
+        label for label in _distinct(dataset, column)
+        if label in wanted or neighbourhood_name(label) in wanted
+    ]
+    if not labels:
+        raise ValueError(f"No neighbourhood in {column} matches {sorted(wanted)}")
+    return labels
+
+
+def build_filter(dataset, years=None, crimes=None, premises=None, neighbourhoods=None,
+                 neighbourhood_column='neighbourhood_158'):
+    """The dashboards' sidebar filters as a pyarrow expression on the raw columns (None = no filter)."""
+    conditions = []
+    if years is not None:
+        conditions.append(
+            (ds.field('occurrence_year') >= years[0]) & (ds.field('occurrence_year') <= years[1])
+        )
+    if crimes:
+        conditions.append(ds.field('mci_category').isin([RAW_CRIME_TYPES.get(crime, crime) for crime in crimes]))
+    if premises:
+        conditions.append(ds.field('premises_type').isin(list(premises)))
+    if neighbourhoods:
+        labels = _neighbourhood_labels(dataset, neighbourhood_column, neighbourhoods)
+        conditions.append(ds.field(neighbourhood_column).isin(labels))
+    return functools.reduce(operator.and_, conditions) if conditions else None
+
+
+def _scan(dataset, columns, row_filter):
+    scanner = dataset.scanner(columns=columns, filter=row_filter, batch_size=BATCH_ROWS)
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def query_incidents(dataset, row_filter, columns=INCIDENT_COLUMNS):
+    """Incident rows (dashboard columns) in file order, one DataFrame per scanned batch."""
+    unknown = [col for col in columns if col not in RAW_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns {unknown}, pick from {list(RAW_COLUMNS)}")
+    raw_columns = [RAW_COLUMNS[col] for col in columns]
+    for df in _scan(dataset, raw_columns, row_filter):
+        yield to_dashboard_columns(df)[columns]
+
+
+def _accumulate(counts, partial):
+    return partial if counts is None else counts.add(partial, fill_value=0)
+
+
+def query_group(dataset, row_filter, group_by='Crime Type'):
+    """Crimes per (group_by, Year) - what the landing page's group summary counts."""
+    counts = None
+    for df in _scan(dataset, [RAW_COLUMNS[group_by], 'occurrence_year'], row_filter):
+        df = to_dashboard_columns(df)
+        counts = _accumulate(counts, df.groupby([group_by, 'Year']).size())
+    if counts is None:
+        return pd.DataFrame(columns=[group_by, 'Year', 'Crimes'])
+    return counts.astype('int64').rename('Crimes').reset_index()
+
+
+def query_rates(dataset, row_filter, group_by=None):
+    """
+    Per 140-model neighbourhood and year: crimes (split by group_by if given),
+    Total Major Crimes, per 1000 people and per km^2 - the compare page's table.
+    """
+    keys = ['hood_140', 'neighbourhood_140', 'occurrence_year']
+    columns = keys + ([RAW_COLUMNS[group_by]] if group_by else [])
+    counts = None
+    for df in _scan(dataset, columns, row_filter):
+        df = to_dashboard_columns(df).rename(columns={
+            'hood_140': 'ID', 'neighbourhood_140': 'Neighbourhood',
+        })
+        counts = _accumulate(counts, df.groupby(['ID', 'Neighbourhood', 'Year'] + ([group_by] if group_by else [])).size())
+    if counts is None:
+        return pd.DataFrame(columns=['ID', 'Neighbourhood', 'Year'] + RATE_METRICS)
+    counts = counts.astype('int64')
+    if group_by:
+        df_rates = counts.unstack(group_by).reset_index()
+        group_vals = [col for col in df_rates.columns if col not in ['ID', 'Neighbourhood', 'Year']]
+        df_rates['Total Major Crimes'] = df_rates[group_vals].sum(axis=1)
+    else:
+        df_rates = counts.rename('Total Major Crimes').reset_index()
+        group_vals = []
+    df_rates.columns.name = None
+    df_rates['ID'] = df_rates['ID'].astype('Int64')
+    nbhd_df = read_neighbourhood_profiles()
+    df_rates = df_rates.merge(nbhd_df[['ID', 'Population', 'Land Area (km^2)']], on='ID', how='left')
+    df_rates['Total Major Crimes / 1000 People'] = (df_rates['Total Major Crimes'] / df_rates['Population'] * 1000).round(1)
+    df_rates['Total Major Crimes / km^2'] = (df_rates['Total Major Crimes'] / df_rates['Land Area (km^2)']).round(1)
+    return df_rates[
+        ['ID', 'Neighbourhood', 'Year'] + RATE_METRICS + group_vals + ['Population', 'Land Area (km^2)']
+    ]
+
+
+def _output_format(output, file_format=None):
+    if file_format:
+        return file_format
+    extension = os.path.splitext(output)[1].lstrip('.').lower()
+    return extension if extension in FORMATS else 'csv'
+
+
+@contextmanager
+def open_writer(output='-', file_format=None):
+    """Yields write(df), appending each DataFrame to output as it comes."""
+    file_format = _output_format(output, file_format)
+    if file_format == 'parquet':
+        if output == '-':
+            raise ValueError("parquet can't be written to stdout, pass -o <file>.parquet")
+        state = {'writer': None}
+
+        def write(df):
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if state['writer'] is None:
+                # columns that are all null in the first batch are strings in the dashboards
+                schema = pa.schema([
+                    field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                    for field in table.schema
+                ]).remove_metadata()
+                state['writer'] = pq.ParquetWriter(output, schema)
+            state['writer'].write_table(table.cast(state['writer'].schema))
+
+        try:
+            yield write
+        finally:
+            if state['writer'] is not None:
+                state['writer'].close()
+        return
+
+    f = sys.stdout if output == '-' else open(output, 'w', newline='')
+    state = {'header': True}
+
+    def write(df):
+        if file_format == 'json':
+            if 'Date' in df:
+                # datetime.date objects would otherwise come out as timestamps, unlike csv / parquet
+                df = df.assign(Date=df['Date'].map(str, na_action='ignore'))
+            if not df.empty:
+                f.write(df.to_json(orient='records', lines=True, date_format='iso').rstrip('\n') + '\n')
+        else:
+            df.to_csv(f, index=False, header=state['header'])
+            state['header'] = False
+
+    try:
+        yield write
+    finally:
+        if f is not sys.stdout:
+            f.close()
+        else:
+            f.flush()
+
+
+def run_query(command, data=None, output='-', file_format=None, years=None, crimes=None,
+              premises=None, neighbourhoods=None, group_by=None, columns=None):
+    """Run one query end to end; returns the number of rows written."""
+    if command == 'rates' and group_by not in [None] + RATE_GROUP_COLUMNS:
+        raise ValueError(f"rates can only be split by {RATE_GROUP_COLUMNS}")
+    dataset = ds.dataset(data or default_data_path(), format='parquet')
+    row_filter = build_filter(
+        dataset, years=years, crimes=crimes, premises=premises, neighbourhoods=neighbourhoods,
+        neighbourhood_column='neighbourhood_140' if command == 'rates' else 'neighbourhood_158',
+    )
+    if command == 'incidents':
+        frames = query_incidents(dataset, row_filter, columns or INCIDENT_COLUMNS)
+    elif command == 'group':
+        frames = [query_group(dataset, row_filter, group_by or 'Crime Type')]
+    else:
+        frames = [query_rates(dataset, row_filter, group_by)]
+    rows = 0
+    with open_writer(output, file_format) as write:
+        for df in frames:
+            write(df)
+            rows += len(df)
+        if rows == 0 and command == 'incidents':
+            write(pd.DataFrame(columns=columns or INCIDENT_COLUMNS))  # header / schema only
+    logger.info(f"Wrote {rows} rows to {'stdout' if output == '-' else output} ✅")
+    return rows
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m utils.query', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('command', choices=['incidents', 'group', 'rates'])
+    parser.add_argument('--data', help='cleaned parquet to query (default: the current snapshot)')
+    parser.add_argument('-o', '--output', default='-', help='output file, - for stdout')
+    parser.add_argument('--format', choices=FORMATS, help='default: from the output extension, else csv')
+    parser.add_argument('--years', nargs=2, type=int, metavar=('FROM', 'TO'), help='inclusive')
+    parser.add_argument('--crime', action='append', help='repeatable, e.g. --crime Assault --crime Robbery')
+    parser.add_argument('--premises', action='append', help='repeatable')
+    parser.add_argument('--neighbourhood', action='append', help='repeatable, name or "Name (id)"')
+    parser.add_argument('--by', choices=GROUP_COLUMNS, help="group / rates: column to split by (group default: 'Crime Type')")
+    parser.add_argument('--columns', nargs='+', help='incidents: dashboard columns to write')
+    return parser
+
+
+if __name__ == "__main__":
+    args = _parser().parse_args()
+    try:
+        run_query(
+            args.command,
+            data=args.data,
+            output=args.output,
+            file_format=args.format,
+            years=args.years,
+            crimes=args.crime,
+            premises=args.premises,
+            neighbourhoods=args.neighbourhood,
+            group_by=args.by,
+            columns=args.columns,
+        )
+    except ValueError as err:
+        logger.error(err)
+        sys.exit(2)
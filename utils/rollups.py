@@ -0,0 +1,119 @@
+"""
+Pre-aggregated crime counts, so trend lines, YoY deltas and rolling windows
+don't have to regroup the incident table on every rerun.
+
+The monthly rollup (one row per Month x Year x ROLLUP_DIMENSIONS) is the
+only thing stored: ROLLUPS_FILE, written into each snapshot when it's
+published (utils.snapshots), so it always matches that snapshot's incidents
+and is never shared between dataset versions. It's counted from scratch
+every publish - the feed recodes back history too, and a full count of the
+incident table takes ~0.1s. Yearly rollups are summed from it on load.
+
+Trailing windows ("12 months up to the latest day in the data") start and
+end mid-month, on the latest day's day of the month. So besides 'Crimes',
+each month keeps AFTER_AS_OF_DAY - its crimes after that day of the month -
+which gives the partial edge months without a daily rollup.
+
+Column names follow utils.st_helpers.load_data (Title Case).
+"""
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils.dataset import RAW_COLUMNS, to_dashboard_columns
+
+ROLLUPS_FILE = 'crime_rollups.parquet'
+ROLLUP_DIMENSIONS = ['Neighbourhood', 'Crime Type', 'Premises Type']
+AFTER_AS_OF_DAY = 'Crimes After As Of Day'
+AS_OF_KEY = b'toronto_crime.rollups_as_of'
+
+
+def monthly_counts(df):
+    """Incidents -> (crimes per Month, Year and ROLLUP_DIMENSIONS, latest incident date)."""
+    date = pd.to_datetime(df['Date'])
+    as_of = date.max()
+    keys = [date.dt.to_period('M').dt.to_timestamp().rename('Month'), df['Year']] + [df[dim] for dim in ROLLUP_DIMENSIONS]
+    monthly = (
+        pd.DataFrame({'Crimes': 1, AFTER_AS_OF_DAY: (date.dt.day > as_of.day).astype('int64')})
+        .groupby(keys).sum().reset_index()
+    )
+    return monthly, as_of
+
+
+def from_parquet(path):
+    """Monthly rollup straight from a cleaned parquet (raw column names), reading only the columns needed."""
+    columns = [RAW_COLUMNS[col] for col in ['Date', 'Year'] + ROLLUP_DIMENSIONS]
+    return monthly_counts(to_dashboard_columns(pd.read_parquet(path, columns=columns)))
+
+
+def save_monthly(monthly, as_of, path):
+    table = pa.Table.from_pandas(monthly, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        AS_OF_KEY: as_of.isoformat().encode(),
+    })
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_monthly(path):
+    table = pq.read_table(path)
+    return table.to_pandas(), pd.Timestamp(table.schema.metadata[AS_OF_KEY].decode())
+
+
+def roll_up(monthly, as_of):
+    yearly = monthly.groupby(['Year'] + ROLLUP_DIMENSIONS)['Crimes'].sum().reset_index()
+    return {'monthly': monthly, 'yearly': yearly, 'as_of': as_of}
+
+
+def filter_rollup(rollup, years=None, crimes=None, premises=None, neighbourhoods=None):
+    """Same filters as the pages' filter_df; None means no filter on that column."""
+    mask = pd.Series(True, index=rollup.index)
+    if years is not None:
+        mask &= (rollup['Year'] >= years[0]) & (rollup['Year'] <= years[1])
+    if crimes is not None:
+        mask &= rollup['Crime Type'].isin(crimes)
+    if premises is not None:
+        mask &= rollup['Premises Type'].isin(premises)
+    if neighbourhoods is not None:
+        mask &= rollup['Neighbourhood'].isin(neighbourhoods)
+    return rollup[mask]
+
+
+def yearly_by_group(rollups, group, **filters):
+    """Crimes per (group, Year), i.e. what groupby([group, 'Year']).size() gives on the incidents."""
+    yearly = filter_rollup(rollups['yearly'], **filters)
+    return yearly.groupby([group, 'Year'])['Crimes'].sum().reset_index()
+
+
+def monthly_trend(rollups, group=None, **filters):
+    monthly = filter_rollup(rollups['monthly'], **filters)
+    keys = ['Month'] if group is None else ['Month', group]
+    return monthly.groupby(keys)['Crimes'].sum().reset_index()
+
+
+def _crimes_between(monthly, start, end):
+    """Crimes in (start, end], both on the as-of day of their month (or that month's last day)."""
+    start_month, end_month = start.to_period('M').to_timestamp(), end.to_period('M').to_timestamp()
+    inside = monthly.loc[(monthly['Month'] > start_month) & (monthly['Month'] < end_month), 'Crimes'].sum()
+    end_part = monthly.loc[monthly['Month'] == end_month, ['Crimes', AFTER_AS_OF_DAY]].sum()
+    start_part = monthly.loc[monthly['Month'] == start_month, AFTER_AS_OF_DAY].sum()
+    return int(inside + end_part['Crimes'] - end_part[AFTER_AS_OF_DAY] + start_part)
+
+
+def trailing_window(rollups, months=12, **filters):
+    """Crimes in the trailing `months` up to the latest day in the data vs the `months` before that."""
+    monthly = filter_rollup(rollups['monthly'], **filters)
+    as_of = rollups['as_of']
+    # both offsets from as_of, so every boundary falls on as_of's day of the month
+    start = as_of - pd.DateOffset(months=months)
+    previous_start = as_of - pd.DateOffset(months=2 * months)
+    value = _crimes_between(monthly, start, as_of)
+    previous = _crimes_between(monthly, previous_start, start)
+    return {
+        'as_of': as_of,
+        'value': value,
+        'previous': previous,
+        'pct_change': 100 * (value / previous - 1) if previous else None,
+    }
@@ -0,0 +1,162 @@
+"""
+Immutable, versioned copies of the dataset shared by every server process
+on the machine.
+
+    data/snapshots/
+        CURRENT                 <- name of the live snapshot, swapped atomically
+        .lock                   <- held by whichever process is publishing
+        20240101T060000Z/       <- one directory per snapshot, never modified
+            cleaned_crime_data.parquet
+            crime_heatmaps.npz      <- utils.heatmaps
+            crime_rollups.parquet   <- utils.rollups
+
+Exactly one process fetches (download / scrape) at a time, under the lock,
+and only if nobody published while it waited for it. Readers never take the
+lock: they read CURRENT and open files inside that snapshot. Since published
+snapshots never change, a reader can't see a half-written file, and a
+process still reading the previous snapshot keeps working until it switches.
+
+    python -m utils.snapshots publish   # fetch + publish a new snapshot now
+"""
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+import coloredlogs, logging
+from decouple import config
+logger = logging.getLogger(__name__)
+coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
+
+try:
+    import fcntl
+except ImportError: # windows - fine for a single local process
+    fcntl = None
+
+SNAPSHOTS_DIR = 'data/snapshots'
+CURRENT_POINTER = 'CURRENT'
+LOCK_FILE = '.lock'
+DATA_FILE = 'cleaned_crime_data.parquet'
+SNAPSHOTS_TO_KEEP = config('SNAPSHOTS_TO_KEEP', default=3, cast=int)
+# 0 = never refresh on its own (publish explicitly / delete the snapshots to refresh)
+SNAPSHOT_MAX_AGE_HOURS = config('SNAPSHOT_MAX_AGE_HOURS', default=0, cast=float)
+VERSION_FORMAT = '%Y%m%dT%H%M%SZ'
+
+
+def current_version(root=SNAPSHOTS_DIR):
+    try:
+        with open(os.path.join(root, CURRENT_POINTER), 'r') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def snapshot_path(version, filename, root=SNAPSHOTS_DIR):
+    return os.path.join(root, version, filename)
+
+
+def published_at(version, root=SNAPSHOTS_DIR):
+    return os.path.getmtime(os.path.join(root, version))
+
+
+def is_stale(version, root=SNAPSHOTS_DIR, max_age_hours=SNAPSHOT_MAX_AGE_HOURS):
+    if version is None:
+        return True
+    if not max_age_hours:
+        return False
+    return time.time() - published_at(version, root) > max_age_hours * 3600
+
+
+@contextmanager
+def publish_lock(root=SNAPSHOTS_DIR, blocking=True):
+    """Inter-process lock for publishing; yields whether it was acquired (always True when blocking)."""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, LOCK_FILE), 'a') as lock_file:
+        if fcntl is None:
+            yield True
+            return
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_pointer(root, version):
+    tmp_path = os.path.join(root, f'.{CURRENT_POINTER}.{os.getpid()}')
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, CURRENT_POINTER))
+
+
+def _prune(root, keep):
+    versions = sorted(
+        name for name in os.listdir(root)
+        if not name.startswith('.') and os.path.isdir(os.path.join(root, name))
+    )
+    for version in versions[:-keep] if keep else []:
+        # processes still reading an old snapshot keep their open files (POSIX)
+        shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+
+def _publish(write_fn, root, keep):
+    version = time.strftime(VERSION_FORMAT, time.gmtime())
+    if version == current_version(root):
+        time.sleep(1)
+        version = time.strftime(VERSION_FORMAT, time.gmtime())
+    tmp_dir = os.path.join(root, f'.tmp-{version}-{os.getpid()}')
+    os.makedirs(tmp_dir)
+    try:
+        write_fn(tmp_dir)
+        os.rename(tmp_dir, os.path.join(root, version))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    _write_pointer(root, version)
+    logger.info(f"Published snapshot {version} ✅")
+    _prune(root, keep)
+    return version
+
+
+def publish_snapshot(write_fn, root=SNAPSHOTS_DIR, keep=SNAPSHOTS_TO_KEEP):
+    """
+    write_fn(snapshot_dir) writes the snapshot's files into a private directory,
+    which then becomes the current snapshot. Returns the new version.
+    """
+    with publish_lock(root):
+        return _publish(write_fn, root, keep)
+
+
+def ensure_snapshot(write_fn, root=SNAPSHOTS_DIR, max_age_hours=SNAPSHOT_MAX_AGE_HOURS, keep=SNAPSHOTS_TO_KEEP):
+    """
+    Current snapshot version, publishing one with write_fn first if there is none
+    (everyone waits for the one writer) or it's older than max_age_hours (one
+    process refreshes, the others keep serving the current snapshot meanwhile).
+    """
+    version = current_version(root)
+    if not is_stale(version, root, max_age_hours):
+        return version
+    with publish_lock(root, blocking=version is None) as acquired:
+        if not acquired:
+            return version
+        # another process may have published while we waited for the lock
+        latest = current_version(root)
+        if latest != version or not is_stale(latest, root, max_age_hours):
+            return latest
+        logger.info(f"Snapshot {version} missing or stale, publishing a new one... 📦")
+        return _publish(write_fn, root, keep)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['publish']:
+        from utils.st_helpers import fetch_snapshot
+        publish_snapshot(fetch_snapshot)
+    else:
+        print(f"current snapshot: {current_version()}")
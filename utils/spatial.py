@@ -0,0 +1,125 @@
+"""
+Point-in-polygon lookup of Toronto's 140 neighbourhoods, from the boundary
+GeoJSON the compare page already draws.
+
+Points are sorted by longitude once, so each polygon only looks at the
+slice inside its bounding box (binary search on longitude, then a latitude
+mask), and the candidates are tested against all of the polygon's edges at
+once with an even-odd ray cast in numpy.
+"""
+import json
+import numpy as np
+
+BOUNDARIES_PATH = 'data/Neighbourhood_Crime_Rates_Boundary_File_clean.json'
+NOT_FOUND = -1
+_MAX_CELLS = 4_000_000  # points x edges per ray-cast chunk, bounds the temporary arrays
+
+
+def _ring_edges(ring):
+    ring = np.asarray(ring, dtype=float)[:, :2]
+    return np.c_[ring, np.roll(ring, -1, axis=0)]  # x1, y1, x2, y2
+
+
+def points_in_polygon(x, y, edges):
+    """Even-odd test of points (x, y) against every edge of a polygon (holes included)."""
+    x1, y1, x2, y2 = edges.T
+    inside = np.zeros(len(x), dtype=bool)
+    step = max(1, _MAX_CELLS // len(edges))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, len(x), step):
+            px = x[start:start + step, None]
+            py = y[start:start + step, None]
+            crosses = ((y1 > py) != (y2 > py)) & (
+                px < (x2 - x1) * (py - y1) / (y2 - y1) + x1
+            )
+            inside[start:start + step] = crosses.sum(axis=1) % 2 == 1
+    return inside
+
+
+class NeighbourhoodIndex():
+
+    def __init__(self, geojson) -> None:
+        ids, names, edges, bboxes = [], [], [], []
+        for feature in geojson['features']:
+            geometry = feature['geometry']
+            polygons = (
+                [geometry['coordinates']] if geometry['type'] == 'Polygon'
+                else geometry['coordinates']
+            )
+            polygon_edges = np.vstack([
+                _ring_edges(ring) for polygon in polygons for ring in polygon
+            ])
+            ids.append(int(feature['properties']['clean_nbdh_id']))
+            names.append(feature['properties']['Neighbourh'])
+            edges.append(polygon_edges)
+            bboxes.append([
+                polygon_edges[:, 0].min(), polygon_edges[:, 1].min(),
+                polygon_edges[:, 0].max(), polygon_edges[:, 1].max(),
+            ])
+        self.ids = np.array(ids, dtype=np.int64)
+        self.names = dict(zip(ids, names))
+        self._edges = edges
+        self._bboxes = np.array(bboxes)
+
+    @classmethod
+    def from_file(cls, path=BOUNDARIES_PATH):
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    def locate(self, lon, lat):
+        """Arrays of lon / lat -> array of neighbourhood ids (NOT_FOUND outside the city or for NaNs)."""
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        located = np.full(lon.shape, NOT_FOUND, dtype=np.int64)
+        order = np.argsort(lon, kind='stable')  # NaNs sort last and never match a bbox
+        sorted_lon = lon[order]
+        for i, (xmin, ymin, xmax, ymax) in enumerate(self._bboxes):
+            lo = np.searchsorted(sorted_lon, xmin, side='left')
+            hi = np.searchsorted(sorted_lon, xmax, side='right')
+            candidates = order[lo:hi]
+            candidates = candidates[
+                (lat[candidates] >= ymin) & (lat[candidates] <= ymax) &
+                (located[candidates] == NOT_FOUND)
+            ]
+            if candidates.size == 0:
+                continue
+            inside = points_in_polygon(lon[candidates], lat[candidates], self._edges[i])
+            located[candidates[inside]] = self.ids[i]
+        return located
+
+    def locate_one(self, lon, lat):
+        """(id, name) of the neighbourhood containing the point, or None."""
+        hood_id = int(self.locate([lon], [lat])[0])
+        if hood_id == NOT_FOUND:
+            return None
+        return hood_id, self.names[hood_id]
+
+    def label(self, hood_id):
+        """Same 'Name (id)' format the feed uses for neighbourhood_140."""
+        return f'{self.names[hood_id]} ({hood_id})'
+
+
+def assign_neighbourhoods(df, index):
+    """
+    Check the feed's hood_140 against the incident coordinates. Blank ids
+    (e.g. the feed's NSA) are filled from the coordinates; ids that
+    disagree with them are counted, not overwritten.
+    Returns {'repaired': {...}, 'verified': {...}} counts in utils.data_schema's stats format.
+    """
+    located = index.locate(df['longitude'], df['latitude'])
+    found = located != NOT_FOUND
+    hood_140 = df['hood_140'].to_numpy(dtype='float64', na_value=np.nan)
+    missing = np.isnan(hood_140)
+    fill = missing & found
+    if fill.any():
+        df.loc[fill, 'hood_140'] = located[fill]
+        df.loc[fill, 'neighbourhood_140'] = [index.label(i) for i in located[fill]]
+    checked = ~missing & found
+    mismatched = checked & (hood_140 != located)
+    return {
+        'repaired': {'hood_140:filled_from_coordinates': int(fill.sum())},
+        'verified': {
+            'hood_140:matches_coordinates': int((checked & ~mismatched).sum()),
+            'hood_140:disagrees_with_coordinates': int(mismatched.sum()),
+        },
+    }
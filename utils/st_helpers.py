@@ -1,24 +1,40 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import io
 import os
-import requests
-from utils.data_scraper import scrape_data
+import shutil
+import functools
+from utils.cache_policy import cache_data
+from utils.figure_cache import cached_figure
+from utils import heatmaps, rollups, snapshots
+from utils.spatial import NeighbourhoodIndex, BOUNDARIES_PATH
+from utils.dataset import (
+    INCIDENT_COLUMNS,
+    clean_crime_types,
+    to_dashboard_columns,
+    read_neighbourhood_profiles,
+)
 import coloredlogs, logging
 import json
-from plotly import express as px
 from decouple import config
 logger = logging.getLogger('crime_in_your_neighbourhood')
 coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
 
 # --------------constants
 CLEAN_DATA_PATH = 'data/cleaned_crime_data.parquet'
+SNAPSHOT_DATA_FILE = snapshots.DATA_FILE
+PAGE_ICON_PATH = './assets/FlaviConTC.png'
 RELEASE_ARTIFACT_URL = (
     "https://github.com/parker84/toronto-crime-dashboard/releases/latest/download/"
     "cleaned_crime_data.parquet"
 )
+PAGE_SIZES = [100, 250, 500, 1000]
+HEATMAP_MIN_FRACTION = 0.01  # cells below this fraction of the peak density aren't drawn
 
 
 def _download_release_artifact(write_path: str) -> bool:
+    import requests
     logger.info(f"Trying GitHub Releases artifact at {RELEASE_ARTIFACT_URL}...")
     try:
         r = requests.get(RELEASE_ARTIFACT_URL, stream=True, timeout=30)
@@ -34,71 +50,121 @@ def _download_release_artifact(write_path: str) -> bool:
         return False
 
 
-def load_or_scrape_data() -> pd.DataFrame:
-    """Lazy three-tier load: local parquet → GitHub Releases → live scrape."""
-    if not os.path.exists(CLEAN_DATA_PATH):
-        logger.info('Local parquet missing. Trying Releases fallback...')
-        if not _download_release_artifact(CLEAN_DATA_PATH):
-            logger.info('Releases fallback failed. Running live scrape...')
-            scrape_data(write_path=CLEAN_DATA_PATH)
-    logger.info(f"Loading parquet from {CLEAN_DATA_PATH}... 📁")
-    return pd.read_parquet(CLEAN_DATA_PATH)
+def fetch_snapshot(snapshot_dir):
+    """
+    Write the dataset into a new snapshot directory (see utils.snapshots):
+    a fresh local parquet (e.g. from `python -m utils.data_scraper`) → GitHub Releases → live scrape.
+    """
+    write_path = os.path.join(snapshot_dir, SNAPSHOT_DATA_FILE)
+    version = snapshots.current_version()
+    if os.path.exists(CLEAN_DATA_PATH) and (
+        version is None or os.path.getmtime(CLEAN_DATA_PATH) > snapshots.published_at(version)
+    ):
+        logger.info(f"Publishing local parquet {CLEAN_DATA_PATH}...")
+        shutil.copyfile(CLEAN_DATA_PATH, write_path)
+        # `python -m utils.data_scraper` writes the heatmaps next to it
+        local_heatmaps_path = os.path.join(os.path.dirname(CLEAN_DATA_PATH), heatmaps.HEATMAPS_FILE)
+        if os.path.exists(local_heatmaps_path) and (
+            os.path.getmtime(local_heatmaps_path) >= os.path.getmtime(CLEAN_DATA_PATH)
+        ):
+            shutil.copyfile(local_heatmaps_path, os.path.join(snapshot_dir, heatmaps.HEATMAPS_FILE))
+    elif not _download_release_artifact(write_path):
+        logger.info('Releases fallback failed. Running live scrape...')
+        from utils.data_scraper import scrape_data
+        scrape_data(write_path=write_path)
+    heatmaps_path = os.path.join(snapshot_dir, heatmaps.HEATMAPS_FILE)
+    if not os.path.exists(heatmaps_path):  # the scrape writes its own, a local one may be copied above
+        heatmaps.save_heatmaps(heatmaps.from_parquet(write_path), heatmaps_path)
+    rollups.save_monthly(*rollups.from_parquet(write_path), os.path.join(snapshot_dir, rollups.ROLLUPS_FILE))
+
 
+def get_dataset_version() -> str:
+    """
+    Current snapshot, fetching the first one if needed. Every server process reads
+    the same snapshot, and they all move to a new one as soon as it's published.
+    """
+    return snapshots.ensure_snapshot(fetch_snapshot)
 
-def clean_crime_types(crime_type):
-    if crime_type == 'Theft Over':
-        return 'Theft Over $5k'
-    else:
-        return crime_type
 
-@st.cache_data()
-def load_data(todays_date):
+def load_or_scrape_data(dataset_version=None) -> pd.DataFrame:
+    """
+    Read the snapshot's parquet; the snapshot is fetched first if there isn't one.
+    Processes share the snapshot file, each still decodes its own DataFrame.
+    """
+    dataset_version = dataset_version or get_dataset_version()
+    path = snapshots.snapshot_path(dataset_version, SNAPSHOT_DATA_FILE)
+    logger.info(f"Loading parquet from {path}... 📁")
+    return pd.read_parquet(path)
+
+
+def _with_dataset_version(cached_fn):
+    """
+    Pass the current snapshot version to cached_fn as `dataset_version`, so its
+    cache entry changes as soon as a new snapshot is published.
+    """
+    @functools.wraps(cached_fn)
+    def wrapper(*args, **kwargs):
+        return cached_fn(*args, dataset_version=get_dataset_version(), **kwargs)
+    return wrapper
+
+
+@st.cache_resource(show_spinner=False)  # runs before set_page_config, so it can't draw a spinner
+def get_page_icon():
+    from PIL import Image
+    image = Image.open(PAGE_ICON_PATH)
+    image.load()
+    return image
+
+
+def get_theme_base():
+    """'dark' or 'light', from the viewer's streamlit theme (light if it can't be read yet)."""
+    from streamlit_theme import st_theme
+    theme = st_theme()
+    if theme is not None and theme['base'] == 'dark':
+        return 'dark'
+    return 'light'
+
+
+@_with_dataset_version
+@cache_data()
+def load_data(todays_date, dataset_version=None):
     # todays_date - is here so that we can trigger the cache to refresh when the date changes
-    df = load_or_scrape_data().rename(columns={
-        'mci_category': 'Crime Type',
-        'offence': 'Offence',
-        'occurrence_year': 'Year',
-        'occurrence_month': 'Month',
-        'occurrence_day': 'Day',
-        'occurrence_hour': 'Hour',
-        'occurrence_dow': 'Day of Week',
-        'location_type': 'Location Type',
-        'premises_type': 'Premises Type',
-        'neighbourhood_158': 'Neighbourhood',
-        'occurence_date': 'Date',
-        'latitude': 'Latitude',
-        'longitude': 'Longitude',
-    })
-    df['Crime Type'] = df['Crime Type'].apply(clean_crime_types)
-    df['Neighbourhood'] = [
-        nbhd.split('(')[0].strip() for nbhd in df['Neighbourhood']
-    ]
+    df = to_dashboard_columns(load_or_scrape_data(dataset_version))
+    # sort once here (newest first) so every filtered slice is already in
+    # incident-table order and paginated_dataframe never has to re-sort
+    df = df.sort_values(
+        by=['Date', 'Hour'], ascending=[False, True], kind='stable'
+    ).reset_index(drop=True)
     return df
 
-@st.cache_data()
+@cache_data()
 def load_counties():
-    with open("./data/Neighbourhood_Crime_Rates_Boundary_File_clean.json", "r") as f:
+    with open(BOUNDARIES_PATH, "r") as f:
         counties = json.load(f)
     return counties
 
-@st.cache_data()
+@st.cache_resource()
+def load_neighbourhood_index():
+    return NeighbourhoodIndex(load_counties())
+
+@_with_dataset_version
+@st.cache_resource(max_entries=2)  # read-only arrays, shared by every session
+def load_heatmaps(todays_date, dataset_version=None):
+    path = snapshots.snapshot_path(dataset_version, heatmaps.HEATMAPS_FILE)
+    if not os.path.exists(path):  # snapshot published before the heatmaps were
+        df = load_data(todays_date=todays_date)
+        return heatmaps.build_heatmaps(df['Crime Type'], df['Year'], df['Latitude'], df['Longitude'])
+    crime_heatmaps = heatmaps.load_heatmaps(path)
+    crime_heatmaps['crime_types'] = np.array([
+        clean_crime_types(crime_type) for crime_type in crime_heatmaps['crime_types']
+    ])
+    return crime_heatmaps
+
+@cache_data()
 def load_neighbourhood_profiles():
-    neighbourhood_profiles = pd.read_csv('./data/neighbourhood-profiles-2016-140-model.csv')
-    nbhd_df = pd.DataFrame([])
-    nbhd_df['ID'] = pd.Series(neighbourhood_profiles[
-        neighbourhood_profiles['Characteristic'] == 'Neighbourhood Number'
-    ].iloc[0].values[6:]).pipe(pd.to_numeric, errors='coerce').astype('Int64')
-    nbhd_df['Neighbourhood'] = neighbourhood_profiles.columns[6:]
-    nbhd_df['Population'] = neighbourhood_profiles[
-        neighbourhood_profiles['Characteristic'] == 'Population, 2016'
-    ].iloc[0].values[6:]
-    nbhd_df['Population'] = nbhd_df['Population'].str.replace(',', '').astype(int)
-    nbhd_df['Land Area (km^2)'] = neighbourhood_profiles[
-        neighbourhood_profiles['Characteristic'] == 'Land area in square kilometres'
-    ].iloc[0].values[6:].astype(float)
-    return nbhd_df
-
-@st.cache_data()
+    return read_neighbourhood_profiles()
+
+@cache_data()
 def get_options(todays_date, df):
     # todays_date - is here so that we can trigger the cache to refresh when the date changes
     logger.info(f"Getting the options... 🎛️")
@@ -112,33 +178,128 @@ def get_options(todays_date, df):
     logger.info(f"Options got got ✅. \n{options}")
     return options
 
-@st.cache_data()
-def get_df_group(df_in, group_by):
+def rank_latest_year(metric_df, group_col, metric_col='Crimes'):
+    """Latest-year rows ranked by metric_col, plus the matching plotly category_orders."""
+    latest_df = metric_df[metric_df[metric_col].notnull()]
+    max_year = latest_df['Year'].max()
+    latest_df = latest_df[
+        latest_df['Year'] == max_year
+    ].sort_values(by=metric_col, ascending=False)
+    return {
+        'max_year': max_year,
+        'latest_df': latest_df,
+        'category_orders': {group_col: latest_df[group_col].tolist()},
+    }
+
+@cache_data()
+def get_group_summary(df_in, group_by):
+    """Group the filtered crimes once per query, see summarize_groups."""
     df_group = df_in.groupby([group_by, 'Year']).size().reset_index()
     df_group.rename(columns={0: 'Crimes'}, inplace=True)
-    df_group = df_group.sort_values(by='Year', ascending=False)
-    return df_group
+    return summarize_groups(df_group, group_by)
+
+@_with_dataset_version
+@st.cache_resource(max_entries=2)  # read-only frames, shared by every session (no unpickling per use)
+def load_rollups(todays_date, dataset_version=None):
+    # todays_date - is here so that we can trigger the cache to refresh when the date changes
+    path = snapshots.snapshot_path(dataset_version, rollups.ROLLUPS_FILE)
+    if not os.path.exists(path):  # snapshot published before the rollups were
+        return rollups.roll_up(*rollups.monthly_counts(load_data(todays_date=todays_date)))
+    return rollups.roll_up(*rollups.load_monthly(path))
+
+def _rollup_filters(years, crimes, premises, neighbourhood):
+    return dict(
+        years=years,
+        crimes=crimes,
+        premises=premises,
+        neighbourhoods=None if neighbourhood == 'All Neighbourhoods 🦝' else [neighbourhood],
+    )
+
+@_with_dataset_version
+@cache_data()
+def get_rollup_group_summary(todays_date, years, crimes, premises, neighbourhood, group_by, dataset_version=None):
+    """get_group_summary straight from the yearly rollup (group_by must be in rollups.ROLLUP_DIMENSIONS)."""
+    df_group = rollups.yearly_by_group(
+        load_rollups(todays_date=todays_date),
+        group_by,
+        **_rollup_filters(years, crimes, premises, neighbourhood)
+    )
+    return summarize_groups(df_group, group_by)
+
+@_with_dataset_version
+@cache_data()
+def get_monthly_trend(todays_date, years, crimes, premises, neighbourhood, group_by=None, dataset_version=None):
+    return rollups.monthly_trend(
+        load_rollups(todays_date=todays_date),
+        group_by,
+        **_rollup_filters(years, crimes, premises, neighbourhood)
+    )
+
+@_with_dataset_version
+@cache_data()
+def get_trailing_12_months(todays_date, crimes, premises, neighbourhood, dataset_version=None):
+    # not limited to the year slider - always the latest 12 months vs the 12 before
+    return rollups.trailing_window(
+        load_rollups(todays_date=todays_date),
+        months=12,
+        **_rollup_filters(None, crimes, premises, neighbourhood)
+    )
+
+def summarize_groups(df_group, group_by):
+    """
+    Precompute everything the tiles and charts need from yearly counts per group value:
+        df_group      - yearly counts per group value (newest year first)
+        group_values  - group values ranked by their busiest year
+        ranking       - see rank_latest_year
+        metrics       - {group value: {'value', 'pct_change'}} latest year vs the one before it
+    """
+    df_group = df_group.sort_values(by='Year', ascending=False, kind='stable')
+
+    # rows are newest-first within each group value, so rank 0 is the latest
+    # year and rank 1 the year before it (same pair show_metric used to diff)
+    year_rank = df_group.groupby(group_by, sort=False).cumcount()
+    latest = df_group[year_rank == 0].set_index(group_by)['Crimes']
+    previous = df_group[year_rank == 1].set_index(group_by)['Crimes']
+    metrics_df = pd.DataFrame({
+        'value': latest,
+        'pct_change': 100 * ((latest / previous.reindex(latest.index)) - 1),
+    })
+
+    group_values = (
+        df_group.groupby(group_by, sort=False)['Crimes'].max()
+        .sort_values(ascending=False, kind='stable')
+        .index.tolist()
+    )
+    return {
+        'df_group': df_group,
+        'group_values': group_values,
+        'ranking': rank_latest_year(df_group, group_by),
+        'metrics': metrics_df.to_dict('index'),
+    }
 
-@st.cache_data()
 def plot_crimes_by_group(
         metric_df, 
         var_to_group_by_col, 
         bar_chart=True,
         metric_col='Crimes', 
-        hover_data=None
+        hover_data=None,
+        ranking=None,
+        cache_key=None
     ):
+    """cache_key - see utils.figure_cache.figure_cache_key; None always rebuilds the figures."""
+    from plotly import express as px
     col1, col2 = st.columns(2)
-    bar_metric_df = metric_df[metric_df[metric_col].isnull() == False]
-    max_year = bar_metric_df['Year'].max()
-    bar_metric_df = bar_metric_df[
-        bar_metric_df['Year'] == max_year
-    ]
-    bar_metric_df = bar_metric_df.sort_values(by=metric_col, ascending=False)
-    category_orders={
-        var_to_group_by_col: bar_metric_df[var_to_group_by_col].tolist()
-    }
+    if ranking is None:
+        ranking = rank_latest_year(metric_df, var_to_group_by_col, metric_col)
+    bar_metric_df = ranking['latest_df']
+    max_year = ranking['max_year']
+    category_orders = ranking['category_orders']
+    if cache_key is not None:
+        cache_key = cache_key + (var_to_group_by_col, metric_col, bar_chart)
     with col1:
-        p = px.line(
+        p = cached_figure(
+            cache_key and ('line',) + cache_key,
+            lambda: px.line(
                 metric_df,
                 x='Year',
                 y=metric_col,
@@ -147,10 +308,11 @@ def plot_crimes_by_group(
                 hover_data=hover_data,
                 category_orders=category_orders
             )
+        )
         st.plotly_chart(p, use_container_width=True)
     with col2:
         if bar_chart:
-            p = px.bar(
+            build_fig = lambda: px.bar(
                     bar_metric_df,
                     y=var_to_group_by_col,
                     x=metric_col,
@@ -160,7 +322,7 @@ def plot_crimes_by_group(
                     category_orders=category_orders
                 )
         else:
-            p = px.pie(
+            build_fig = lambda: px.pie(
                 bar_metric_df,
                 names=var_to_group_by_col,
                 values=metric_col,
@@ -169,37 +331,39 @@ def plot_crimes_by_group(
                 category_orders=category_orders,
                 hover_data=hover_data
             )
+        p = cached_figure(cache_key and ('breakdown',) + cache_key, build_fig)
         st.plotly_chart(p, use_container_width=True)
         return category_orders
 
-@st.cache_data()
+def plot_monthly_trend(monthly_df, group_by=None, cache_key=None):
+    from plotly import express as px
+    p = cached_figure(
+        cache_key and ('monthly_trend',) + cache_key + (group_by,),
+        lambda: px.line(
+            monthly_df,
+            x='Month',
+            y='Crimes',
+            color=group_by,
+            title='Monthly Crimes' if group_by is None else f'Monthly Crimes by {group_by}',
+        )
+    )
+    st.plotly_chart(p, use_container_width=True)
+
 def show_metric(
-        df, 
-        y_col, 
+        value, 
+        pct_change=None, 
         format_str='{:,}', 
         delta_color='normal', 
         title=None, 
-        help=None, 
-        calc_per_change=True
+        help=None
     ):
-        if title is None:
-            title = y_col
-        if calc_per_change:
-            try:
-                percentage_change = (
-                    100 * ((df[y_col].iloc[0] / df[y_col].iloc[1]) - 1)
-                )
-                delta='{change}% (YoY)'.format(
-                    change=round(percentage_change, 2)
-                )
-            except Exception as err:
-                logger.error(err)
-                delta = None
-        else: 
+        if pct_change is None or pd.isnull(pct_change):
             delta = None
+        else:
+            delta = '{change}% (YoY)'.format(change=round(pct_change, 2))
         st.metric(
             title,
-            value=format_str.format(df[y_col].iloc[0]),
+            value=format_str.format(value),
             delta=delta,
             delta_color=delta_color,
             help=help
@@ -240,15 +404,60 @@ def page_footer():
         "[Contact Me](mailto:parkerbrydon@gmail.com)"
     )
 
-@st.cache_data()
+def paginated_dataframe(df, columns=INCIDENT_COLUMNS, key='incidents'):
+    """Render one page of incidents; df must already be in (Date, Hour) order (see load_data)."""
+    n_rows = df.shape[0]
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        page_size = st.selectbox('Rows per page', PAGE_SIZES, index=0, key=f'{key}_page_size')
+    n_pages = max(1, -(-n_rows // page_size))
+    with col2:
+        page = st.number_input('Page', min_value=1, max_value=n_pages, value=1, step=1, key=f'{key}_page')
+    start = (min(page, n_pages) - 1) * page_size
+    stop = min(start + page_size, n_rows)
+    df_page = df.iloc[start:stop][columns]
+    df_page.index = range(start + 1, stop + 1)
+    st.dataframe(df_page)
+    st.caption(f'Showing {start + 1 if n_rows else 0:,}–{stop:,} of {n_rows:,} crimes')
+    with col3:
+        export_button(df[columns], key=key)
+
+def _export_bytes(df, file_format):
+    buf = io.BytesIO()
+    if file_format == 'Parquet':
+        df.to_parquet(buf, index=False)
+    else:
+        # chunked into the byte buffer rather than one big intermediate str; the whole
+        # file still ends up in memory (and download_button keeps its own copy), it's
+        # just only built when the user asks for it
+        text_buf = io.TextIOWrapper(buf, encoding='utf-8', write_through=True)
+        df.to_csv(text_buf, index=False, chunksize=50_000)
+        text_buf.detach()
+    return buf.getvalue()
+
+def export_button(df, key='incidents'):
+    """Two-step export: the full result is only serialized once the user asks for it."""
+    file_format = st.radio('Export', ['CSV', 'Parquet'], horizontal=True, key=f'{key}_export_format')
+    if st.button(f'Prepare {file_format} export 📥', key=f'{key}_export'):
+        with st.spinner('Preparing export...'):
+            data = _export_bytes(df, file_format)
+        st.download_button(
+            f'Download {df.shape[0]:,} rows',
+            data=data,
+            file_name=f'toronto_crime.{file_format.lower()}',
+            mime='text/csv' if file_format == 'CSV' else 'application/octet-stream',
+            key=f'{key}_download',
+        )
+
+@cache_data()
 def get_hood_140_to_nbhd_mapping(df):
     assert 'ID' in df.columns, 'missing "ID" column'
     assert 'Neighbourhood' in df.columns, 'missing "Neighbourhood" column'
     out_df = df[['ID', 'Neighbourhood']].drop_duplicates()
     return out_df
 
-@st.cache_data()
 def get_mapbox_plot(df, group, zoom, mapbox_style, center, category_orders=None):
+    from plotly import express as px
     p = px.scatter_mapbox(
         df, 
         lat="Latitude", 
@@ -273,4 +482,29 @@ def get_mapbox_plot(df, group, zoom, mapbox_style, center, category_orders=None)
         category_orders=category_orders
     )
     p.update_layout(mapbox_style=mapbox_style)
-    return p
\ No newline at end of file
+    return p
+
+
+def get_heatmap_plot(crime_heatmaps, crimes, years, zoom, mapbox_style, center):
+    """City-wide density of the selected crimes / years from the precomputed rasters (see utils.heatmaps)."""
+    from plotly import graph_objects as go
+    crime_density = heatmaps.density(crime_heatmaps, crime_types=crimes, years=years)
+    lat, lon = heatmaps.cell_centres(crime_heatmaps)
+    lat_idx, lon_idx = np.nonzero(crime_density > crime_density.max() * HEATMAP_MIN_FRACTION)
+    p = go.Figure(go.Densitymapbox(
+        lat=lat[lat_idx],
+        lon=lon[lon_idx],
+        z=crime_density[lat_idx, lon_idx],
+        radius=8,
+        colorbar=dict(title='Crimes / km²'),
+        hovertemplate='%{z:,.0f} crimes / km²<extra></extra>',
+    ))
+    p.update_layout(
+        mapbox_style=mapbox_style,
+        mapbox_zoom=zoom,
+        mapbox_center=center,
+        height=800,
+        width=1200,
+        margin=dict(l=0, r=0, t=0, b=0),
+    )
+    return p
@@ -0,0 +1,71 @@
+"""
+Preload the artifacts every session shares (dataset, dropdown options,
+rollups, heatmaps, neighbourhood boundaries + index + profiles, page icon) before the first visitor
+shows up, instead of on their first rerun.
+
+    python -m utils.warmup          # fetch + load everything once and log timings
+    python -m utils.warmup serve [streamlit run flags]   # warm up, then start the app in this same process
+
+`serve` is what makes the warm-up stick: st.cache_data / st.cache_resource
+live in the server process, so they have to be filled in that process, and
+st.cache_data only stores results written from inside a script run (hence
+the headless AppTest run below). Use it in place of `streamlit run`; any
+extra arguments (e.g. --server.port 8502) are passed straight through to it.
+"""
+import sys
+import time
+import coloredlogs, logging
+from decouple import config
+logger = logging.getLogger(__name__)
+coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
+
+MAIN_SCRIPT = '🦝Crime_in_Your_Neighbourhood.py'
+
+
+def warm_up():
+    """Fill the process-wide caches. Returns {step: seconds}."""
+    import pandas as pd
+    from utils import st_helpers
+
+    todays_date = pd.to_datetime('today').date()
+    timings = {}
+
+    def timed(step, fn, **kwargs):
+        start = time.perf_counter()
+        result = fn(**kwargs)
+        timings[step] = time.perf_counter() - start
+        logger.info(f"warmed {step} in {timings[step]:.2f}s")
+        return result
+
+    df = timed('dataset', st_helpers.load_data, todays_date=todays_date)
+    timed('options', st_helpers.get_options, todays_date=todays_date, df=df)
+    timed('rollups', st_helpers.load_rollups, todays_date=todays_date)
+    timed('heatmaps', st_helpers.load_heatmaps, todays_date=todays_date)
+    timed('boundaries', st_helpers.load_counties)
+    timed('neighbourhood index', st_helpers.load_neighbourhood_index)
+    timed('neighbourhood profiles', st_helpers.load_neighbourhood_profiles)
+    timed('page icon', st_helpers.get_page_icon)
+    logger.info(f"Warm-up done in {sum(timings.values()):.2f}s ✅")
+    return timings
+
+
+def _warm_up_script():
+    # AppTest.from_function runs this source as its own script, hence the import
+    from utils.warmup import warm_up
+    warm_up()
+
+
+def serve(streamlit_args=()):
+    from streamlit.testing.v1 import AppTest
+    from streamlit.web import cli as stcli
+    start = time.perf_counter()
+    AppTest.from_function(_warm_up_script, default_timeout=600).run()
+    logger.info(f"Caches warm after {time.perf_counter() - start:.2f}s, starting the server... 🚀")
+    stcli.main(['run', MAIN_SCRIPT, *streamlit_args])
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['serve']:
+        serve(sys.argv[2:])
+    else:
+        warm_up()
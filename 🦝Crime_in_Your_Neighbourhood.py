@@ -4,25 +4,36 @@ import coloredlogs, logging
 from utils.st_helpers import (
     load_data, 
     get_options, 
-    get_df_group, 
+    get_group_summary, 
+    get_rollup_group_summary,
+    get_monthly_trend,
+    get_trailing_12_months,
     show_metric, 
     plot_crimes_by_group, 
+    plot_monthly_trend,
     sidebar_filters,
     sidebar_promo,
     page_footer,
-    get_mapbox_plot
+    get_page_icon,
+    get_theme_base,
+    paginated_dataframe,
+    get_mapbox_plot,
+    get_heatmap_plot,
+    load_heatmaps,
+    get_dataset_version,
+    INCIDENT_COLUMNS
 )
-from PIL import Image
-from streamlit_theme import st_theme
+from utils.cache_policy import cache_data
+from utils.figure_cache import cached_figure, figure_cache_key
+from utils.rollups import ROLLUP_DIMENSIONS
 from decouple import config
 logger = logging.getLogger('crime_in_your_neighbourhood')
 coloredlogs.install(level=config('LOG_LEVEL', 'INFO'), logger=logger)
 
 # --------------setup
-cn_tower_image = Image.open('./assets/FlaviConTC.png')
 st.set_page_config(
     page_title='TorCrime', 
-    page_icon=cn_tower_image,
+    page_icon=get_page_icon(),
     layout="wide", 
     initial_sidebar_state="auto", 
     menu_items=None
@@ -30,7 +41,12 @@ st.set_page_config(
 st.title("🦝 Toronto Crime Dashboard")
 
 # --------------helpers
-@st.cache_data()
+def get_mapbox_style():
+    if get_theme_base() == 'dark':
+        return "carto-darkmatter"
+    return "carto-positron"
+
+@cache_data()
 def filter_df(df, years, crimes, premises, neighbourhood):
     df_filtered = df[
         (df['Year'] >= years[0]) &
@@ -72,35 +88,30 @@ if neighbourhood is None:
     page_footer()
     st.stop()
 
-# -------------helpers
-@st.cache_data()
-def get_group_values(df_group, group):
-    return df_group.sort_values(by='Crimes', ascending=False)[group].unique().tolist()
-
-@st.cache_data()
-def get_max_year(df_filtered):
-    return int(df_filtered['Year'].max())
-
-@st.cache_data()
-def show_dataframe(df_filtered):
-    df_out = df_filtered[[
-        'Date', 'Crime Type', 'Offence', 'Location Type', 'Premises Type', 'Year', 'Month', 'Day', 'Hour', 'Day of Week', 'Neighbourhood', 'Latitude', 'Longitude'
-    ]].sort_values(by=['Date', 'Hour'], ascending=[False, True])
-    df_out.index = range(1, df_out.shape[0]+1)
-    st.dataframe(df_out)
-    return df_out
-
 # --------------filtering
-df_filtered = filter_df(
-    df=df, 
-    years=years, 
-    crimes=crimes, 
-    premises=premises, 
-    neighbourhood=neighbourhood
-)
-df_group = get_df_group(df_filtered, group_by=group)
-group_values = get_group_values(df_group, group)
-max_year = get_max_year(df_filtered)
+if group in ROLLUP_DIMENSIONS:
+    # answered from the pre-aggregated counts, no pass over the incidents
+    group_summary = get_rollup_group_summary(
+        todays_date=todays_date,
+        years=years,
+        crimes=crimes,
+        premises=premises,
+        neighbourhood=neighbourhood,
+        group_by=group
+    )
+else:
+    df_filtered = filter_df(
+        df=df, 
+        years=years, 
+        crimes=crimes, 
+        premises=premises, 
+        neighbourhood=neighbourhood
+    )
+    group_summary = get_group_summary(df_filtered, group_by=group)
+df_group = group_summary['df_group']
+group_values = group_summary['group_values']
+max_year = int(group_summary['ranking']['max_year'])
+query_key = figure_cache_key('neighbourhood', get_dataset_version(), years, crimes, premises, neighbourhood)
 
 # -------------visuals
 if group != 'Hour':
@@ -109,11 +120,10 @@ if group != 'Hour':
     for i in range(n_group_vals):
         group_val = group_values[i]
         with cols[i]:
+            metric = group_summary['metrics'][group_val]
             show_metric(
-                df_group[
-                    df_group[group] == group_val
-                ],
-                y_col='Crimes',
+                int(metric['value']),
+                pct_change=metric['pct_change'],
                 title=group_val,
                 help=f'{group_val} Crimes for `{max_year}` in {neighbourhood}',
             )
@@ -123,10 +133,49 @@ category_orders = plot_crimes_by_group(
     var_to_group_by_col=group,
     metric_col='Crimes',
     bar_chart=False,
+    ranking=group_summary['ranking'],
+    cache_key=query_key,
+)
+
+trend_group = group if group in ROLLUP_DIMENSIONS else None
+trailing = get_trailing_12_months(
+    todays_date=todays_date,
+    crimes=crimes,
+    premises=premises,
+    neighbourhood=neighbourhood
 )
+col1, col2 = st.columns([1, 4])
+with col1:
+    show_metric(
+        trailing['value'],
+        pct_change=trailing['pct_change'],
+        title='Last 12 Months',
+        help=f"Crimes in the 12 months up to `{trailing['as_of'].date()}` vs the 12 months before, in {neighbourhood}",
+    )
+with col2:
+    plot_monthly_trend(
+        get_monthly_trend(
+            todays_date=todays_date,
+            years=years,
+            crimes=crimes,
+            premises=premises,
+            neighbourhood=neighbourhood,
+            group_by=trend_group
+        ),
+        group_by=trend_group,
+        cache_key=query_key,
+    )
  
 if neighbourhood != 'All Neighbourhoods 🦝':
-    df_out = show_dataframe(df_filtered)
+    df_filtered = filter_df(
+        df=df, 
+        years=years, 
+        crimes=crimes, 
+        premises=premises, 
+        neighbourhood=neighbourhood
+    )
+    paginated_dataframe(df_filtered, key='neighbourhood_incidents')
+    df_out = df_filtered[INCIDENT_COLUMNS]
 
     with st.spinner("Loading the map... 🗺️"):
         if neighbourhood == 'All Neighbourhoods 🦝':
@@ -135,22 +184,36 @@ if neighbourhood != 'All Neighbourhoods 🦝':
         else:
             center = dict(lat=df_out['Latitude'].mean(), lon=df_out['Longitude'].mean())
             zoom = 13
-        theme = st_theme()
-        if theme is not None:
-            if theme['base'] == 'dark':
-                mapbox_style="carto-darkmatter"
-            else:
-                mapbox_style="carto-positron"
-        else:
-            mapbox_style="carto-positron"
-        p = get_mapbox_plot(
-            df=df_out, 
-            group=group, 
-            zoom=zoom, 
-            mapbox_style=mapbox_style, 
-            center=center,
-            category_orders=category_orders
+        mapbox_style = get_mapbox_style()
+        p = cached_figure(
+            ('mapbox',) + query_key + (group, mapbox_style),
+            lambda: get_mapbox_plot(
+                df=df_out, 
+                group=group, 
+                zoom=zoom, 
+                mapbox_style=mapbox_style, 
+                center=center,
+                category_orders=category_orders
+            )
+        )
+        st.plotly_chart(p, use_container_width=True)
+else:
+    # city-wide: too many points to draw, so a density map from the precomputed rasters
+    with st.spinner("Loading the heatmap... 🔥"):
+        mapbox_style = get_mapbox_style()
+        p = cached_figure(
+            ('heatmap',) + query_key + (mapbox_style,),
+            lambda: get_heatmap_plot(
+                crime_heatmaps=load_heatmaps(todays_date=todays_date),
+                crimes=crimes,
+                years=years,
+                zoom=10,
+                mapbox_style=mapbox_style,
+                center=dict(lat=43.715, lon=-79.38),
+            )
         )
         st.plotly_chart(p, use_container_width=True)
+    if len(premises) < len(options['premises_types']):
+        st.caption("The heatmap includes every premises type.")
 
 page_footer()
\ No newline at end of file